@@ -4,18 +4,30 @@ import os
 import traceback
 from typing import Optional
 from loytra_common import log_factory
-from loytra_common.utils import TCOL
+from loytra_common.options import options
+from loytra_common.utils import TCOL, parallel_map, get_millis, millis_passed
 from loytra_modules import Moduler
+from loytra_modules._loytra_moduler import fetch_modulers, FETCH_MODE_FULL, FETCH_MODE_NEGOTIATE
+from loytra_modules._git_cache import prune_git_cache
 from loytra_modules._module_finder import find_loytra_modules, get_loytra_modules_by_folder_name
 from loytra_modules._token_storage import storage_write_value
 from loytra_modules._module_spec import LoytraModule, LoytraModuleInstance
 from loytra_modules._loytra_packager import Packager, PackagerGroup
+from loytra_modules._packager_transaction import PackagerTransaction
+from loytra_modules._loytra_servicer import prefetch_systemd_states, systemd_reload_batch, restart_servicers
 
 
 class LoytraCliActions:
     def __init__(self):
         self._logger = log_factory.get(name="svs_cli_actions", tag="SVS:CLI:ACTIONS")
-        self._modules = find_loytra_modules()
+        self._found_modules: Optional[dict[str, LoytraModule]] = None
+
+    @property
+    def _modules(self) -> dict[str, LoytraModule]:
+        # module discovery runs only for commands which use modules
+        if self._found_modules is None:
+            self._found_modules = find_loytra_modules()
+        return self._found_modules
 
     def modules(self):
         return self._modules
@@ -77,14 +89,14 @@ class LoytraCliActions:
         github_token = self._input_or_none("Token[None]: ")
         return hash, github_token
 
-    def install(self, module_name, hash = None, github_token = None):
+    def install(self, module_name, hash = None, github_token = None, force = False):
         moduler = self.get_moduler_by_module_name(module_name, print_error=False)
         if moduler is not None:
             if hash == None and github_token == None:
                 hash, github_token = self._get_moduler_install_params()
             moduler.github_token = github_token
             moduler.hash = hash
-            if (moduler.install()):
+            if (moduler.install(force)):
                 storage_write_value(module_name, github_token)
                 return True
         else:
@@ -99,7 +111,7 @@ class LoytraCliActions:
                         loytra_modules = get_loytra_modules_by_folder_name(folder_name)
                         for loytra_module in loytra_modules:
                             if isinstance(loytra_module, LoytraModuleInstance):
-                                loytra_module.moduler.install_module()
+                                loytra_module.moduler.install_module(force)
                                 storage_write_value(loytra_module.module_name, github_token)
                         return True
                 except Exception as e:
@@ -125,25 +137,42 @@ class LoytraCliActions:
             if not servicer.is_enabled():
                 servicer.uninstall()
 
+    def _restart_running_services(self):
+        targets = []
+        for module in self._modules.values():
+            if not isinstance(module, LoytraModuleInstance):
+                self._logger.warning(f"Module {module.module_name} is not installed!")
+                continue
+            for service, servicer in module.services.items():
+                if f"{module.module_name}" in ["devconn_vpn_client"]:
+                    self._logger.warning(f"Ignoring restart of {module.module_name}/{service}")
+                else:
+                    targets.append((module, f"{module.module_name}/{service}", servicer))
+
+        prefetch_systemd_states([servicer for _, _, servicer in targets])
+        running = [(m, name, servicer) for m, name, servicer in targets if servicer.get_active_state().startswith("activ")]
+        # all changed unit files share one daemon-reload, flushed by the first restart
+        with systemd_reload_batch():
+            for _, _, servicer in targets:
+                servicer.install()
+
+            # modules with the same sort_index restart together, lower sort_index first
+            groups: dict[int, list] = {}
+            for target in running:
+                sort_index = target[0].sort_index if target[0].sort_index >= 0 else 999999
+                groups.setdefault(sort_index, []).append(target)
+            for sort_index in sorted(groups.keys()):
+                group = groups[sort_index]
+                for (_, name, _), time_to_active in zip(group, restart_servicers([servicer for _, _, servicer in group])):
+                    if time_to_active is None:
+                        print(f"  {name} [{TCOL.FAIL}FAILED{TCOL.END}]")
+                    else:
+                        print(f"  {name} [{TCOL.OKGREEN}active{TCOL.END} in {time_to_active / 1000:.1f} s]")
+
     def restart(self, module_service_name=None):
         if module_service_name is None or len(module_service_name.strip()) == 0:
             print(f"{TCOL.FAIL}{TCOL.BOLD}{'Restarting running services:'}{TCOL.END}")
-            for module in self._modules.values():
-                if not isinstance(module, LoytraModuleInstance):
-                    self._logger.warning(f"Module {module.module_name} is not installed!")
-                    continue
-
-                for service in module.services:
-                    servicer = module.services[service]
-                    active = servicer.get_active_state().startswith("activ")
-                    if f"{module.module_name}" in ["devconn_vpn_client"]:
-                        self._logger.warning(f"Ignoring restart of {module.module_name}/{service}")
-                    else:
-                        servicer.install()
-                        if active:
-                            name = f"{module.module_name}/{service}"
-                            print(f"  {name}")
-                            servicer.restart()
+            self._restart_running_services()
         else:
             servicer = self.get_servicer_by_module_service_name(module_service_name)
             if servicer is not None:
@@ -227,10 +256,21 @@ class LoytraCliActions:
 
     def sync(self, module_package_name):
         found_module, found_packager = self._find_module_packager_in_path(module_package_name)
-        if found_module is not None and found_packager is not None and found_module.moduler.is_installed():
-            found_packager.sync()
-        else:
+        packagers: list[Packager] = []
+        if isinstance(found_module, LoytraModuleInstance) and found_module.moduler.is_installed():
+            if found_packager is not None:
+                packagers = [found_packager]
+            elif module_package_name.strip("/") == found_module.module_name:
+                packagers = list(found_module.packages.values())
+
+        if len(packagers) == 0:
             self._logger.error(f"Package {module_package_name} not found.")
+        elif len(packagers) == 1 and not isinstance(packagers[0], PackagerGroup):
+            packagers[0].sync()
+        else:
+            # whole modules and groups install with one command per package backend
+            for packager, success in PackagerTransaction(packagers).run():
+                print(f"  {packager.name} [{(TCOL.FAIL + 'FAILED', TCOL.OKGREEN + 'OK')[success]}{TCOL.END}]")
 
     def unsync(self, module_package_name):
         found_module, found_packager = self._find_module_packager_in_path(module_package_name)
@@ -239,28 +279,36 @@ class LoytraCliActions:
         else:
             self._logger.error(f"Package {module_package_name} not found.")
 
+    def _get_service_status_string(self, service_name, servicer):
+        if not servicer.is_installed():
+            return f"  {TCOL.FAIL}{TCOL.BOLD}{service_name}{TCOL.END}"
+        color = TCOL.OKGREEN
+        if servicer.is_enabled():
+            if not servicer.get_active_state().startswith("activ"):
+                color = TCOL.OKBLUE
+        else:
+            if servicer.get_active_state().startswith("activ"):
+                color = TCOL.WARNING
+        return f"  {color}{TCOL.BOLD}{service_name}{TCOL.END} [{servicer.get_status()}]"
+
     def status(self):
-        for module in self._modules.values():
-            string = ""
-            if isinstance(module, LoytraModuleInstance) and module.moduler.is_installed():
-                services = module.services
-                if len(services) > 0:
-                    string += f"{TCOL.BOLD}{module.module_name}{TCOL.END}"
-                    for service_name, servicer in services.items():
-                        string += "\n"
-                        if not servicer.is_installed():
-                            string += f"  {TCOL.FAIL}{TCOL.BOLD}{service_name}{TCOL.END}"
-                        else:
-                            color = TCOL.OKGREEN
-                            if servicer.is_enabled():
-                                if not servicer.get_active_state().startswith("activ"):
-                                    color = TCOL.OKBLUE
-                            else:
-                                if servicer.get_active_state().startswith("activ"):
-                                    color = TCOL.WARNING
-
-                            string += f"  {color}{TCOL.BOLD}{service_name}{TCOL.END} [{servicer.get_status()}]"
-            if len(string): print(string)
+        modules = [m for m in self._modules.values() if isinstance(m, LoytraModuleInstance) and len(m.services) > 0]
+        installed = parallel_map(modules, lambda m: m.moduler.is_installed(), limit=options.jobs)
+        modules = [m for m, is_installed in zip(modules, installed) if is_installed]
+
+        # one batched systemd query for all units, remaining probes run concurrently, print in module order
+        services = [(m.module_name, service_name, servicer) for m in modules for service_name, servicer in m.services.items()]
+        prefetch_systemd_states([servicer for _, _, servicer in services])
+        service_strings = parallel_map(services, lambda s: self._get_service_status_string(s[1], s[2]), limit=options.jobs)
+        module_lines: dict[str, list[str]] = { m.module_name: [] for m in modules }
+        for (module_name, _, _), service_string in zip(services, service_strings):
+            module_lines[module_name].append(service_string)
+
+        for module in modules:
+            string = f"{TCOL.BOLD}{module.module_name}{TCOL.END}"
+            for line in module_lines[module.module_name]:
+                string += "\n" + line
+            print(string)
 
     def _traverse_packagers_for_list(self, packagers: list[Packager], level: int = 0):
         for packager in packagers:
@@ -270,89 +318,87 @@ class LoytraCliActions:
             else:
                 yield (packager, level, False)
 
-    def list(self):
-        for module in self._modules.values():
-            string = ""
-            instance_status_suffix = ""
-            if module.deprecated_replaced_by is not None:
-                instance_status_suffix += f" [{TCOL.FAIL}{TCOL.BOLD}DEPRECATED{TCOL.END}"
-                if len(module.deprecated_replaced_by) > 0:
-                    instance_status_suffix += f" by {TCOL.WARNING}{TCOL.BOLD}{module.deprecated_replaced_by}{TCOL.END}"
-                instance_status_suffix += "]"
-
-            if isinstance(module, LoytraModuleInstance) and module.moduler.is_installed():
-                fetch_status = module.moduler.fetch()
-                string += f"{TCOL.OKGREEN}{TCOL.BOLD}{module.module_name}{TCOL.END} [{module.moduler.get_status(fetch_status=fetch_status)}]{instance_status_suffix}"
-                for packager, level, is_group in self._traverse_packagers_for_list(list(module.packages.values())):
-                    string += "\n"
-                    padd = "  " + ("  " * level)
-                    if is_group:
-                        string += f"{TCOL.BOLD}{padd}{packager.name}:{TCOL.END}"
-                    else:
-                        string += f"{padd}{packager.name} [{packager.get_status()}]"
-            else:
-                string += f"{TCOL.FAIL}{TCOL.BOLD}{module.module_name}{TCOL.END}"
+    def _get_module_list_string(self, module: LoytraModule, fetch_status: Optional[bool]):
+        string = ""
+        instance_status_suffix = ""
+        if module.deprecated_replaced_by is not None:
+            instance_status_suffix += f" [{TCOL.FAIL}{TCOL.BOLD}DEPRECATED{TCOL.END}"
+            if len(module.deprecated_replaced_by) > 0:
+                instance_status_suffix += f" by {TCOL.WARNING}{TCOL.BOLD}{module.deprecated_replaced_by}{TCOL.END}"
+            instance_status_suffix += "]"
+
+        if isinstance(module, LoytraModuleInstance) and module.moduler.is_installed():
+            string += f"{TCOL.OKGREEN}{TCOL.BOLD}{module.module_name}{TCOL.END} [{module.moduler.get_status(fetch_status=fetch_status)}]{instance_status_suffix}"
+            for packager, level, is_group in self._traverse_packagers_for_list(list(module.packages.values())):
+                string += "\n"
+                padd = "  " + ("  " * level)
+                if is_group:
+                    string += f"{TCOL.BOLD}{padd}{packager.name}:{TCOL.END}"
+                else:
+                    string += f"{padd}{packager.name} [{packager.get_status()}]"
+        else:
+            string += f"{TCOL.FAIL}{TCOL.BOLD}{module.module_name}{TCOL.END}"
+        return string
 
+    def list(self):
+        # fetch all installed repos first, then probe modules concurrently, print in module order
+        modules = list(self._modules.values())
+        installed = parallel_map(modules, lambda m: isinstance(m, LoytraModuleInstance) and m.moduler.is_installed(), limit=options.jobs)
+        fetched_modules = [m for m, is_installed in zip(modules, installed) if is_installed]
+        fetch_statuses = dict(zip([id(m) for m in fetched_modules], fetch_modulers([m.moduler for m in fetched_modules], limit=options.jobs)))
+        strings = parallel_map(modules, lambda m: self._get_module_list_string(m, fetch_statuses.get(id(m))), limit=options.jobs)
+        for string in strings:
             if len(string): print(string)
 
-    def update(self, module_name=None):
+    def _update_module(self, module: LoytraModuleInstance, force=False) -> tuple[bool, Optional[int]]:
+        """Stops the module's running services only around its own checkout, returns success and downtime in ms."""
+        running_servicers = []
+        for service, servicer in module.services.items():
+            if f"{module.module_name}" in ["devconn_vpn_client"]:
+                self._logger.warning(f"Ignoring update of {module.module_name}/{service}")
+            elif servicer.get_active_state().startswith("activ"):
+                running_servicers.append(servicer)
+
+        timestamp = get_millis()
+        success = False
+        try:
+            for servicer in running_servicers:
+                servicer.stop()
+            success = module.moduler.update(fetched=True, force=force)
+        finally:
+            # services come back up even when the update raised
+            # changed unit files of the module share one daemon-reload, flushed by the first start
+            with systemd_reload_batch():
+                for servicer in running_servicers:
+                    servicer.install()
+                for servicer in running_servicers:
+                    servicer.start()
+        return success, millis_passed(timestamp) if len(running_servicers) > 0 else None
+
+    def update(self, module_name=None, force=False):
         if module_name is None or len(module_name.strip()) == 0:
-            running_services = {}
-            print(f"{TCOL.FAIL}{TCOL.BOLD}{'Stoping running services:'}{TCOL.END}")
-            for module in self._modules.values():
-                if not isinstance(module, LoytraModuleInstance):
-                    continue
-
-                for service in module.services:
-                    if f"{module.module_name}" in ["devconn_vpn_client"]:
-                        self._logger.warning(f"Ignoring update of {module.module_name}/{service}")
-                    else:
-                        servicer = module.services[service]
-                        if servicer.get_active_state().startswith("activ"):
-                            name = f"{module.module_name}/{service}"
-                            running_services[name] = servicer
-                            print(f"  {name}")
-                            servicer.stop()
-
-            print(f"{TCOL.OKBLUE}{TCOL.BOLD}{'Updating repos:'}{TCOL.END}")
-            for module in self._modules.values():
-                if not isinstance(module, LoytraModuleInstance):
-                    continue
-
-                moduler = module.moduler
-                if moduler.is_installed():
-                    print(f"  {module.module_name}")
-                    moduler.update()
-                    moduler.install()
-
-            print(f"{TCOL.OKGREEN}{TCOL.BOLD}{'Resuming services:'}{TCOL.END}")
-            for service in running_services:
-                print(f"  {service}")
-                running_services[service].install()
-                running_services[service].start()
+            modules = [m for m in self._modules.values() if isinstance(m, LoytraModuleInstance)]
         else:
-            moduler = self.get_moduler_by_module_name(module_name)
-            if moduler is not None:
-                running_services = {}
-                module = self._modules.get(module_name)
-                if module is not None and isinstance(module, LoytraModuleInstance):
-                    print(f"{TCOL.FAIL}{TCOL.BOLD}{'Stoping running services:'}{TCOL.END}")
-                    for service in module.services:
-                        servicer = module.services[service]
-                        if servicer.get_active_state().startswith("activ"):
-                            name = f"{module_name}/{service}"
-                            running_services[name] = servicer
-                            print(f"  {name}")
-                            servicer.stop()
-                    print(f"{TCOL.OKBLUE}{TCOL.BOLD}{'Updating repo:'}{TCOL.END}")
-                    if moduler.is_installed():
-                        print(f"  {module_name}")
-                        moduler.update()
-                    print(f"{TCOL.OKGREEN}{TCOL.BOLD}{'Resuming services:'}{TCOL.END}")
-                    for service in running_services:
-                        print(f"  {service}")
-                        running_services[service].install()
-                        running_services[service].start()
+            if self.get_moduler_by_module_name(module_name) is None:
+                return
+            module = self._modules.get(module_name)
+            modules = [module] if isinstance(module, LoytraModuleInstance) else []
+        installed = parallel_map(modules, lambda m: m.moduler.is_installed(), limit=options.jobs)
+        modules = [m for m, is_installed in zip(modules, installed) if is_installed]
+
+        # network work happens while all services keep running
+        print(f"{TCOL.OKBLUE}{TCOL.BOLD}{'Fetching repos:'}{TCOL.END}")
+        # a negotiate only fetch leaves the remote refs untouched, updating needs them
+        fetch_mode = FETCH_MODE_FULL if options.fetch_mode == FETCH_MODE_NEGOTIATE else options.fetch_mode
+        for module, fetch_status in zip(modules, fetch_modulers([m.moduler for m in modules], limit=options.jobs, mode=fetch_mode)):
+            print(f"  {module.module_name} [{(TCOL.FAIL + 'FAILED', TCOL.OKGREEN + 'OK')[bool(fetch_status)]}{TCOL.END}]")
+
+        print(f"{TCOL.OKGREEN}{TCOL.BOLD}{'Updating repos:'}{TCOL.END}")
+        prefetch_systemd_states([servicer for m in modules for servicer in m.services.values()])
+        for module in modules:
+            success, downtime = self._update_module(module, force)
+            downtime_str = "no running services" if downtime is None else f"downtime {downtime / 1000:.1f} s"
+            print(f"  {module.module_name} [{(TCOL.FAIL + 'FAILED', TCOL.OKGREEN + 'OK')[success]}{TCOL.END}] {downtime_str}")
 
     def clean(self):
         for module in self._modules.values():
@@ -360,4 +406,14 @@ class LoytraCliActions:
                 moduler = module.moduler
                 if moduler.is_installed():
                     moduler.clean()
-                    moduler.install()
+                    # clean removes the build metadata of the editable install
+                    moduler.install(force=True)
+
+    def cache_prune(self):
+        # objects of modules which are no longer installed are dropped
+        keep_urls = [m.moduler.url for m in self._modules.values() if isinstance(m, LoytraModuleInstance) and m.moduler.is_installed()]
+        sizes = prune_git_cache(keep_urls)
+        if sizes is None:
+            print("No git cache")
+        else:
+            print(f"Git cache {sizes[0] / 1024 / 1024:.1f} MB -> {sizes[1] / 1024 / 1024:.1f} MB")
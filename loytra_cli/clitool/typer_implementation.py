@@ -1,109 +1,90 @@
 #!/usr/bin/env python3
 
 import typer
-from typing import Optional
-from loytra_cli.clitool.actions import LoytraCliActions
-import loytra_cli.dmapi_sim.dmapi_client as dmapi_client
+from typing import Optional, TYPE_CHECKING
 from loytra_common.options import options
-from loytra_common import log_factory
-from loytra_common.utils import TCOL
 
+if TYPE_CHECKING:
+    from loytra_cli.clitool.actions import LoytraCliActions
 
 
-actions: Optional[LoytraCliActions] = None
+
+actions: Optional["LoytraCliActions"] = None
 app = typer.Typer(help="Loytra")
 
 
-@app.command()
-def install(module_name, hash = None, github_token = None):
-    
+def _get_actions() -> "LoytraCliActions":
+    # heavy imports are deferred to the commands which need them, keeping --help and completion fast
+    global actions
     if actions is None:
-        return
-    actions.install(module_name, hash, github_token)
+        from loytra_cli.clitool.actions import LoytraCliActions
+        actions = LoytraCliActions()
+    return actions
+
+
+@app.command()
+def install(module_name, hash = None, github_token = None, force: bool = typer.Option(False, help="Reinstall pip package even if unchanged")):
+    _get_actions().install(module_name, hash, github_token, force)
 
 
 @app.command()
 def uninstall(module_name):
-    if actions is None:
-        return
-    actions.uninstall(module_name)
+    _get_actions().uninstall(module_name)
 
 
 @app.command()
 def start(module_service_name):
-    if actions is None:
-        return
-    actions.start(module_service_name)
+    _get_actions().start(module_service_name)
 
 
 @app.command()
 def stop(module_service_name: Optional[str] = typer.Argument(None)):
-    if actions is None:
-        return
-    actions.stop(module_service_name)
+    _get_actions().stop(module_service_name)
 
 
 @app.command()
 def restart(module_service_name: Optional[str] = typer.Argument(None)):
-    if actions is None:
-        return
-    actions.restart(module_service_name)
+    _get_actions().restart(module_service_name)
 
 
 @app.command()
 def enable(module_service_name):
-    if actions is None:
-        return
-    actions.enable(module_service_name)
+    _get_actions().enable(module_service_name)
 
 
 @app.command()
 def disable(module_service_name):
-    if actions is None:
-        return
-    actions.disable(module_service_name)
+    _get_actions().disable(module_service_name)
 
 
 @app.command()
 def logs(module_service_name):
-    if actions is None:
-        return
-    actions.logs(module_service_name)
+    _get_actions().logs(module_service_name)
 
 
 @app.command()
 def debug(module_service_name):
-    if actions is None:
-        return
-    actions.debug(module_service_name)
+    _get_actions().debug(module_service_name)
 
 
 @app.command()
 def run(module_service_name):
-    if actions is None:
-        return
-    actions.run(module_service_name)
+    _get_actions().run(module_service_name)
 
 
 @app.command()
 def sync(module_package_name):
-    if actions is None:
-        return
-    actions.sync(module_package_name)
+    _get_actions().sync(module_package_name)
 
 
 @app.command()
 def unsync(module_package_name):
-    if actions is None:
-        return
-    actions.unsync(module_package_name)
+    _get_actions().unsync(module_package_name)
 
 
 @app.command()
 def status():
-    if actions is None:
-        return
-    actions.status()
+    _get_actions().status()
 
 
 @app.command()
@@ -117,34 +98,43 @@ def list():
         - U repo has untracked files\n
         - F fetch failed\n
     """
-    if actions is None:
-        return
-    actions.list()
+    _get_actions().list()
 
 
 @app.command()
-def update(module_name: Optional[str] = typer.Argument(None)):
-    if actions is None:
-        return
-    actions.update(module_name)
+def update(module_name: Optional[str] = typer.Argument(None), force: bool = typer.Option(False, help="Reinstall pip packages even if unchanged")):
+    _get_actions().update(module_name, force)
 
 
 @app.command()
 def clean():
-    if actions is None:
-        return
-    actions.clean()
+    _get_actions().clean()
+
+
+@app.command()
+def cache_prune():
+    """
+    Remove git cache objects of modules which are no longer installed
+    """
+    _get_actions().cache_prune()
+
 
 @app.command()
 def api_sim(definition: Optional[str] = typer.Argument(None)):
     if definition is None:
         return
+    import loytra_cli.dmapi_sim.dmapi_client as dmapi_client
     dmapi_client.run(definition)
 
 
 @app.callback()
-def main(verbose: bool = False):
-    global actions
+def main(verbose: bool = False, jobs: int = typer.Option(options.jobs, help="Max number of concurrent probes"),
+         git_cache: bool = typer.Option(options.git_cache, help="Share git objects between module clones"),
+         fetch_mode: str = typer.Option(options.fetch_mode, help="Git fetch of list and update: full, shallow or negotiate (list only)")):
     options.verbose = verbose
-    if actions is None:
-        actions = LoytraCliActions()
+    options.git_cache = git_cache
+    if fetch_mode not in ["full", "shallow", "negotiate"]:
+        raise typer.BadParameter(f"Unknown fetch mode {fetch_mode}", param_hint="--fetch-mode")
+    options.fetch_mode = fetch_mode
+    if jobs > 0:
+        options.jobs = jobs
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Import time guard for the loytra CLI startup path.
+
+Run with `python -m loytra_cli.startup_bench [BUDGET_MS]`. Exits with a non-zero code when the
+CLI entry module pulls in heavy dependencies at import time or when its own import time exceeds
+the budget (third party CLI framework time excluded).
+"""
+import subprocess
+import sys
+from typing import Optional
+
+STARTUP_MODULE = "loytra_cli.clitool.typer_implementation"
+FRAMEWORK_MODULE = "typer"
+HEAVY_MODULES = [
+    "git",
+    "websockets",
+    "loytra_modules",
+    "loytra_cli.clitool.actions",
+    "loytra_cli.dmapi_sim.dmapi_client",
+]
+DEFAULT_BUDGET_MS = 50
+
+
+def _measure_import_times(module: str) -> Optional[dict[str, int]]:
+    """Cumulative import time per module in us, None when importing the module failed."""
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    p = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        # a failing import can still print timings for everything before the error
+        errors = [line for line in p.stderr.splitlines() if not line.startswith("import time:")]
+        print("\n".join(errors[-10:]))
+        return None
+    result: dict[str, int] = {}
+    for line in p.stderr.splitlines():
+        # import time:   self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            result[parts[2].strip()] = int(parts[1].strip())
+        except ValueError:
+            pass
+    return result
+
+
+def run(budget_ms: int = DEFAULT_BUDGET_MS) -> bool:
+    import_times = _measure_import_times(STARTUP_MODULE)
+    if import_times is None or STARTUP_MODULE not in import_times:
+        print(f"FAIL: could not import {STARTUP_MODULE}")
+        return False
+
+    success = True
+    for heavy_module in HEAVY_MODULES:
+        if heavy_module in import_times:
+            print(f"FAIL: {heavy_module} is imported at startup")
+            success = False
+
+    total_us = import_times[STARTUP_MODULE]
+    own_us = total_us - import_times.get(FRAMEWORK_MODULE, 0)
+    print(f"startup import: total {total_us / 1000:.1f} ms, loytra {own_us / 1000:.1f} ms (budget {budget_ms} ms)")
+    if own_us > budget_ms * 1000:
+        print("FAIL: startup import budget exceeded")
+        success = False
+    return success
+
+
+if __name__ == "__main__":
+    budget = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    sys.exit(0 if run(budget) else 1)
@@ -2,9 +2,34 @@ import os
 
 class Options:
     verbose: bool = False
+    jobs: int = 8
+    systemd_backend: str = "auto"
+    clone_strategy: str = "full"
+    git_cache: bool = False
+    fetch_mode: str = "full"
 
 options = Options()
 
 loytra_verbose = os.environ.get("LOYTRA_VERBOSE", "0")
 if loytra_verbose == "1":
     options.verbose = True
+
+loytra_jobs = os.environ.get("LOYTRA_JOBS")
+if loytra_jobs is not None and loytra_jobs.isdigit() and int(loytra_jobs) > 0:
+    options.jobs = int(loytra_jobs)
+
+loytra_systemd_backend = os.environ.get("LOYTRA_SYSTEMD_BACKEND")
+if loytra_systemd_backend in ["auto", "dbus", "subprocess"]:
+    options.systemd_backend = loytra_systemd_backend
+
+loytra_clone_strategy = os.environ.get("LOYTRA_CLONE_STRATEGY")
+if loytra_clone_strategy in ["full", "shallow", "blobless"]:
+    options.clone_strategy = loytra_clone_strategy
+
+loytra_fetch_mode = os.environ.get("LOYTRA_FETCH_MODE")
+if loytra_fetch_mode in ["full", "shallow", "negotiate"]:
+    options.fetch_mode = loytra_fetch_mode
+
+loytra_git_cache = os.environ.get("LOYTRA_GIT_CACHE", "0")
+if loytra_git_cache == "1":
+    options.git_cache = True
@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 import os
-import sys
+import codecs
 import shutil
 import select
+import signal
 import pty
-from subprocess import Popen
+import threading
+import weakref
+import shlex
+import subprocess
 from time import time, sleep
 import asyncio
 import getpass
 from pathlib import Path
 from loytra_common.options import options
 from loytra_common import log_factory
+from typing import Optional
 import re
 
 
@@ -29,6 +34,23 @@ def parallel_loop(items, func):
     asyncio.run(async_parallel_loop(items, func))
 
 
+async def async_parallel_map(items, func, limit=None):
+    semaphore = asyncio.Semaphore(limit) if limit is not None and limit > 0 else None
+
+    async def _run(item):
+        if semaphore is None:
+            return await asyncio.to_thread(func, item)
+        async with semaphore:
+            return await asyncio.to_thread(func, item)
+
+    return await asyncio.gather(*[_run(item) for item in items])
+
+
+def parallel_map(items, func, limit=None):
+    """Run func for every item in worker threads, returns results in items order."""
+    return asyncio.run(async_parallel_map(items, func, limit))
+
+
 class TCOL:
     # Foreground:
     HEADER = '\033[95m'
@@ -53,6 +75,9 @@ def millis_passed(timestamp):
 
 
 loytra_linux_password = None
+_linux_password_lock = threading.Lock()
+# held by everything that prompts on the terminal, so concurrent steps never interleave prompts
+terminal_lock = threading.RLock()
 
 
 def get_linux_password_noninteractive():
@@ -66,69 +91,356 @@ def get_linux_password_noninteractive():
 
 def get_linux_password():
     global loytra_linux_password
-    password = get_linux_password_noninteractive()
-    if password is None:
-        from getpass import getpass
-        password = getpass("Enter [sudo] password: ")
-        loytra_linux_password = password
-        return loytra_linux_password
-    return password
+    # concurrent commands must not prompt more than once
+    with _linux_password_lock:
+        password = get_linux_password_noninteractive()
+        if password is None:
+            from getpass import getpass
+            with terminal_lock:
+                password = getpass("Enter [sudo] password: ")
+            loytra_linux_password = password
+            return loytra_linux_password
+        return password
+
+
+class _PtyOutputParser:
+    """Splits pty output into lines and answers interaction prompts."""
+
+    def __init__(self, interaction, cr_as_newline=False, logger=None):
+        self._interaction = { str(k): str(v) for k, v in interaction.items() }
+        self._interaction_values = set(self._interaction.values())
+        self._prompt_re = re.compile("|".join(re.escape(k) for k in self._interaction)) if self._interaction else None
+        self._prompt_overlap = max([len(k) for k in self._interaction], default=1) - 1
+        self._cr_as_newline = cr_as_newline
+        self._logger = logger
+        self._decoder = codecs.getincrementaldecoder("UTF-8")(errors="replace")
+        self._partial: list[str] = []
+        self._tail = ""
+
+    def _complete_line(self, line):
+        if line and line not in self._interaction_values:
+            if self._logger: self._logger(f"STD: {repr(line)}")
+            return line.strip().split('\r')[-1]
+        return None
+
+    def feed(self, data: bytes) -> tuple[list[str], Optional[bytes]]:
+        """Returns completed lines and the prompt response to write back, if any."""
+        text = self._decoder.decode(data)
+        if self._cr_as_newline:
+            text = text.replace("\r", "\n")
+        lines = []
+        parts = text.split("\n")
+        if len(parts) > 1:
+            self._partial.append(parts[0])
+            line = self._complete_line("".join(self._partial))
+            if line is not None:
+                lines.append(line)
+            for part in parts[1:-1]:
+                line = self._complete_line(part)
+                if line is not None:
+                    lines.append(line)
+            self._partial = []
+            self._tail = ""
+        if parts[-1]:
+            self._partial.append(parts[-1])
+        return lines, self._match_prompt(parts[-1])
+
+    def _match_prompt(self, text) -> Optional[bytes]:
+        if self._prompt_re is None or len(self._partial) == 0:
+            return None
+        # only the new text and enough overlap to catch a prompt split across reads is scanned
+        window = self._tail + text
+        m = self._prompt_re.search(window)
+        if m is None:
+            self._tail = window[-self._prompt_overlap:] if self._prompt_overlap > 0 else ""
+            return None
+        if self._logger: self._logger(f"PMT: {''.join(self._partial)}")
+        self._partial = []
+        self._tail = ""
+        return f"{self._interaction[m.group(0)]}\r\n".encode()
+
+    def flush(self) -> list[str]:
+        self._partial.append(self._decoder.decode(b"", final=True))
+        line = "".join(self._partial)
+        self._partial = []
+        self._tail = ""
+        if line:
+            return [line.strip().split('\r')[-1]]
+        return []
 
 
-def run_bash_cmd(cmd, logger=None, interaction={}, return_lines=True, return_code=False, cr_as_newline=False, remove_empty_lines=False):
-    if options.verbose:
-        logger = local_logger.debug
-    if logger: logger(f"CMD: {cmd}")
+def _get_cmd_interaction(cmd, interaction):
+    interaction = dict(interaction) if interaction is not None else {}
     if "sudo " in cmd: interaction["sudo"] = get_linux_password()
-    master_fd, slave_fd = pty.openpty()
-    line = ""
+    return interaction
+
+
+def _iter_fd_until_exit(p, read_fd, parser, write_fd=None):
+    pidfd = None
+    try:
+        pidfd = os.pidfd_open(p.pid)
+    except (AttributeError, OSError):
+        pass
+
+    try:
+        # block until there is output or the process exits, no periodic wakeups
+        exited = False
+        while not exited:
+            wait_fds = [read_fd] if pidfd is None else [read_fd, pidfd]
+            r, _, _ = select.select(wait_fds, [], [], None if pidfd is not None else 0.5)
+            if pidfd is not None and pidfd in r:
+                exited = True
+            elif pidfd is None and p.poll() is not None:
+                exited = True
+            if read_fd in r or exited:
+                # after exit drain what is left without blocking
+                while True:
+                    if exited and not select.select([read_fd], [], [], 0)[0]:
+                        break
+                    try:
+                        data = os.read(read_fd, 65536)
+                    except OSError:
+                        exited = True
+                        break
+                    if not data:
+                        exited = True
+                        break
+                    new_lines, response = parser.feed(data)
+                    yield from new_lines
+                    if response is not None and write_fd is not None:
+                        os.write(write_fd, response)
+                    if not exited:
+                        break
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+    yield from parser.flush()
+
+
+def _iter_cmd_output(cmd, parser, interactive):
+    """Yields output lines while cmd runs and returns its return code."""
+    if interactive:
+        master_fd, slave_fd = pty.openpty()
+        try:
+            p = subprocess.Popen(_cmd_to_str(cmd), shell=True, start_new_session=True, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd)
+        except:
+            os.close(master_fd)
+            raise
+        finally:
+            # only the child holds the slave side, reads fail with EIO once it is gone
+            os.close(slave_fd)
+        read_fd, write_fd = master_fd, master_fd
+    else:
+        # pipes instead of a pty, and no shell at all when the command is a plain argv
+        argv = _get_cmd_argv(cmd)
+        try:
+            if argv is not None:
+                p = subprocess.Popen(argv, start_new_session=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            else:
+                p = subprocess.Popen(cmd, shell=True, start_new_session=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except (FileNotFoundError, PermissionError) as e:
+            yield f"{argv[0] if argv else cmd}: {e.strerror}"
+            return 127
+        read_fd, write_fd = p.stdout.fileno(), None
+
+    try:
+        yield from _iter_fd_until_exit(p, read_fd, parser, write_fd)
+    except BaseException:
+        # the consumer stopped early (GeneratorExit), do not leave the command running
+        if p.poll() is None:
+            _kill_process_group(p)
+        raise
+    finally:
+        # output can end (EOF) before the exit is reported, wait instead of killing
+        p.wait()
+        if interactive:
+            os.close(read_fd)
+        else:
+            p.stdout.close()
+    return p.returncode
+
+
+def _collect_cmd_output(output) -> tuple[list[str], int]:
     lines = []
-    with Popen(cmd, shell=True, preexec_fn=os.setsid, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd, universal_newlines=True) as p:
-        while p.poll() is None:
-            r, w, e = select.select([sys.stdin, master_fd], [], [], 0.01)
-            if master_fd in r:
-                o = os.read(master_fd, 10240).decode("UTF-8")
-                if o:
-                    for c in o:
-                        if cr_as_newline and c == "\r":
-                            c = "\n"
-                        if c == "\n":
-                            if line and line not in interaction.values():
-                                clean = line.strip().split('\r')[-1]
-                                lines.append(clean)
-                                if logger: logger(f"STD: {repr(line)}")
-                            line = ""
-                        else:
-                            line += c
-            if line:  # pass password to prompt
-                for key in interaction:
-                    if key in line:
-                        if logger: logger(f"PMT: {line}")
-                        # sleep(1) #TODO: if stops working check this
-                        os.write(master_fd, ("%s" % (interaction[key])).encode())
-                        os.write(master_fd, "\r\n".encode())
-                        line = ""
-        if line:
-            clean = line.strip().split('\r')[-1]
-            lines.append(clean)
+    while True:
+        try:
+            lines.append(next(output))
+        except StopIteration as e:
+            return lines, e.value
 
-    os.close(master_fd)
-    os.close(slave_fd)
 
+def _format_cmd_result(lines, returncode, logger, return_lines, return_code, remove_empty_lines):
     if remove_empty_lines:
         lines = list(filter(lambda l: len(l) > 0, lines))
 
     if return_lines and return_code:
-        if logger: logger(f"RET: L[{lines}], C[{p.returncode}]")
-        return lines, p.returncode
+        if logger: logger(f"RET: L[{lines}], C[{returncode}]")
+        return lines, returncode
     elif return_code:
-        if logger: logger(f"RET: C[{p.returncode}]")
-        return p.returncode
+        if logger: logger(f"RET: C[{returncode}]")
+        return returncode
     else:
         if logger: logger(f"RET: L{lines}")
         return lines
 
 
+_SHELL_SYNTAX_RE = re.compile(r"[|&;<>()$`\\*?\[\]{}~#\n]|^\s*\w+=")
+
+
+def _get_cmd_argv(cmd) -> Optional[list[str]]:
+    if isinstance(cmd, (list, tuple)):
+        return [str(arg) for arg in cmd]
+    if _SHELL_SYNTAX_RE.search(cmd):
+        return None
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return None
+
+
+def _cmd_to_str(cmd):
+    if isinstance(cmd, (list, tuple)):
+        return " ".join(shlex.quote(str(arg)) for arg in cmd)
+    return cmd
+
+
+def run_bash_cmd(cmd, logger=None, interaction=None, return_lines=True, return_code=False, cr_as_newline=False, remove_empty_lines=False,
+                 interactive: Optional[bool] = None):
+    """Runs cmd (a shell string or an argv list) and returns its output lines and/or return code.
+
+    Interactive commands run in a pty so prompts can be answered from interaction. Commands without
+    interaction and without sudo (or declared with interactive=False) take a faster pipe based path,
+    without a shell when the command has no shell syntax.
+    """
+    if options.verbose:
+        logger = local_logger.debug
+    if logger: logger(f"CMD: {cmd}")
+    interaction = _get_cmd_interaction(_cmd_to_str(cmd), interaction)
+    parser = _PtyOutputParser(interaction, cr_as_newline, logger)
+    if interactive is None:
+        interactive = len(interaction) > 0
+    lines, returncode = _collect_cmd_output(_iter_cmd_output(cmd, parser, interactive))
+    return _format_cmd_result(lines, returncode, logger, return_lines, return_code, remove_empty_lines)
+
+
+def iter_bash_cmd(cmd, logger=None, interaction=None, cr_as_newline=False, remove_empty_lines=False, interactive: Optional[bool] = None):
+    """Streaming run_bash_cmd, yields output lines as they arrive.
+
+    Closing the generator early (e.g. breaking out of a for loop once a match is found) kills the
+    command. The return code is the generator's return value.
+    """
+    if options.verbose:
+        logger = local_logger.debug
+    if logger: logger(f"CMD: {cmd}")
+    interaction = _get_cmd_interaction(_cmd_to_str(cmd), interaction)
+    parser = _PtyOutputParser(interaction, cr_as_newline, logger)
+    if interactive is None:
+        interactive = len(interaction) > 0
+    output = _iter_cmd_output(cmd, parser, interactive)
+    try:
+        while True:
+            try:
+                line = next(output)
+            except StopIteration as e:
+                return e.value
+            if remove_empty_lines and len(line) == 0:
+                continue
+            yield line
+    finally:
+        output.close()
+
+
+_async_cmd_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _get_async_cmd_limiter() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    limiter = _async_cmd_limiters.get(loop)
+    if limiter is None:
+        limiter = asyncio.Semaphore(options.jobs)
+        _async_cmd_limiters[loop] = limiter
+    return limiter
+
+
+def _kill_process_group(p):
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _async_read_pty_until_exit(p, master_fd, parser, timeout):
+    loop = asyncio.get_running_loop()
+    lines = []
+
+    def on_readable():
+        while True:
+            try:
+                data = os.read(master_fd, 65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                loop.remove_reader(master_fd)
+                return
+            new_lines, response = parser.feed(data)
+            lines.extend(new_lines)
+            if response is not None:
+                os.write(master_fd, response)
+
+    loop.add_reader(master_fd, on_readable)
+    try:
+        await asyncio.wait_for(p.wait(), timeout)
+        # drain output still buffered in the pty
+        on_readable()
+    except BaseException:
+        # timeout or cancellation, do not leave the command running
+        _kill_process_group(p)
+        await asyncio.shield(p.wait())
+        raise
+    finally:
+        loop.remove_reader(master_fd)
+
+    lines.extend(parser.flush())
+    return lines
+
+
+async def async_run_bash_cmd(cmd, logger=None, interaction=None, return_lines=True, return_code=False, cr_as_newline=False, remove_empty_lines=False,
+                             timeout=None, limiter: Optional[asyncio.Semaphore] = None):
+    """Async run_bash_cmd with the same interaction and return semantics, cmd is a shell string or an argv list.
+
+    At most options.jobs commands run at once per event loop unless a custom limiter is given.
+    On timeout or cancellation the command's process group is killed and the exception propagates.
+    """
+    if options.verbose:
+        logger = local_logger.debug
+    cmd_str = _cmd_to_str(cmd)
+    if "sudo " in cmd_str:
+        # the password prompt blocks, keep it off the event loop
+        interaction = await asyncio.to_thread(_get_cmd_interaction, cmd_str, interaction)
+    else:
+        interaction = _get_cmd_interaction(cmd_str, interaction)
+    parser = _PtyOutputParser(interaction, cr_as_newline, logger)
+    async with (limiter if limiter is not None else _get_async_cmd_limiter()):
+        if logger: logger(f"CMD: {cmd}")
+        master_fd, slave_fd = pty.openpty()
+        try:
+            os.set_blocking(master_fd, False)
+            try:
+                if isinstance(cmd, (list, tuple)):
+                    p = await asyncio.create_subprocess_exec(*[str(arg) for arg in cmd], start_new_session=True, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd)
+                else:
+                    p = await asyncio.create_subprocess_shell(cmd, start_new_session=True, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd)
+            finally:
+                os.close(slave_fd)
+            lines = await _async_read_pty_until_exit(p, master_fd, parser, timeout)
+        finally:
+            os.close(master_fd)
+
+    return _format_cmd_result(lines, p.returncode, logger, return_lines, return_code, remove_empty_lines)
+
+
 def get_full_path(path):
     return os.path.realpath(os.path.expanduser(path))
 
@@ -180,6 +492,17 @@ def remove_file(path, sudo_required=False):
             run_bash_cmd(f"sudo rm {get_full_path(path)}")
 
 
+def get_path_size(path):
+    size = 0
+    for root, _, files in os.walk(get_full_path(path)):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return size
+
+
 def get_file_list_in_path(path):
     return os.listdir(path)
 
@@ -195,3 +518,15 @@ def get_path_of_current_file(f):
 def create_dir_if_not_found(path):
     if not os.path.exists(get_full_path(path)):
         os.makedirs(get_full_path(path))
+
+
+if __name__ == "__main__":
+    # per call latency of the pty path vs the direct (pipe, no shell) path
+    for bench_cmd in ["true", "groups"]:
+        for is_interactive in [True, False]:
+            count = 200
+            start = time()
+            for _ in range(count):
+                run_bash_cmd(bench_cmd, interactive=is_interactive)
+            elapsed_ms = (time() - start) * 1000 / count
+            print(f"{bench_cmd:8} {['direct', 'pty'][is_interactive]:6} {elapsed_ms:.2f} ms/call")
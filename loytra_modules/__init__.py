@@ -5,6 +5,7 @@ from loytra_modules._loytra_packager import Packager, PackagerGroup, PackagerUse
 from loytra_modules._loytra_servicer import Servicer, DynamicServicer, PythonServicer
 
 from loytra_modules._service_runner import get_service_run_command
+from loytra_modules._service_notify import notify_ready, notify_status, notify_watchdog
 from loytra_modules._util import get_loytra_parent_path
 
 from loytra_modules._token_storage import storage_read_value, storage_write_value
@@ -32,6 +33,9 @@ __all__ = [
         'PythonServicer',
 
         'get_service_run_command',
+        'notify_ready',
+        'notify_status',
+        'notify_watchdog',
         'get_loytra_parent_path',
 
         'storage_read_value',
@@ -0,0 +1,86 @@
+import os
+import re
+from typing import Optional
+from loytra_common import log_factory
+from loytra_common.options import options
+from loytra_common.utils import run_bash_cmd, check_if_path_exists, get_full_path, get_path_size
+
+_GIT_CACHE_PATH = "~/.local/share/loytra/git_cache.git"
+_GIT_CACHE_FULL_PATH = os.path.abspath(os.path.expanduser(_GIT_CACHE_PATH))
+_GIT_CACHE_REF_PREFIX = "refs/loytra"
+
+_logger = log_factory.get(name="svs_git_cache", tag="GIT:CACHE")
+
+
+def is_git_cache_enabled() -> bool:
+    return options.git_cache
+
+
+def _get_cache_namespace(url) -> str:
+    # one ref namespace per module url, tokens never end up in the cache
+    url = re.sub(r"^[a-z]+://", "", url)
+    url = re.sub(r"^[^/@]+@", "", url)
+    return re.sub(r"[^A-Za-z0-9._-]", "_", url.removesuffix(".git").strip("/"))
+
+
+def _ensure_git_cache() -> bool:
+    if check_if_path_exists(f"{_GIT_CACHE_FULL_PATH}/objects"):
+        return True
+    return run_bash_cmd(["git", "init", "-q", "--bare", _GIT_CACHE_FULL_PATH], interactive=False, return_lines=False, return_code=True) == 0
+
+
+def get_git_cache_clone_args() -> str:
+    """Extra 'git clone' arguments which take already cached objects from the local cache.
+
+    The clone copies what it needs and drops the link (--dissociate), so pruning the cache never
+    breaks an installed repo.
+    """
+    if not is_git_cache_enabled() or not _ensure_git_cache():
+        return ""
+    return f"--reference-if-able {_GIT_CACHE_FULL_PATH} --dissociate"
+
+
+def _is_complete_repo(install_location) -> bool:
+    # shallow and partial clones can not serve all objects their refs point to
+    if check_if_path_exists(f"{get_full_path(install_location)}/.git/shallow"):
+        return False
+    cmd = ["git", "-C", get_full_path(install_location), "config", "--get", "extensions.partialclone"]
+    return run_bash_cmd(cmd, interactive=False, return_lines=False, return_code=True) != 0
+
+
+def seed_git_cache(install_location, url) -> bool:
+    """Copies a local module repo's objects into the cache, no network access."""
+    if not is_git_cache_enabled() or not _is_complete_repo(install_location) or not _ensure_git_cache():
+        return False
+    namespace = f"{_GIT_CACHE_REF_PREFIX}/{_get_cache_namespace(url)}"
+    cmd = [
+        "git", "-C", _GIT_CACHE_FULL_PATH, "fetch", "-q", "--no-tags", "--prune", get_full_path(install_location),
+        f"+refs/remotes/origin/*:{namespace}/heads/*",
+        f"+refs/tags/*:{namespace}/tags/*",
+    ]
+    success = run_bash_cmd(cmd, interactive=False, return_lines=False, return_code=True) == 0
+    if not success:
+        _logger.warning(f"Could not seed cache from {install_location}")
+    return success
+
+
+def prune_git_cache(keep_urls: Optional[list[str]] = None) -> Optional[tuple[int, int]]:
+    """Drops cached refs of urls not in keep_urls and removes unreachable objects.
+
+    Returns the cache size in bytes before and after, None without a cache.
+    """
+    if not check_if_path_exists(f"{_GIT_CACHE_FULL_PATH}/objects"):
+        return None
+    size = get_path_size(_GIT_CACHE_FULL_PATH)
+    if keep_urls is not None:
+        keep_namespaces = { _get_cache_namespace(url) for url in keep_urls }
+        cmd = ["git", "-C", _GIT_CACHE_FULL_PATH, "for-each-ref", "--format=%(refname)", f"{_GIT_CACHE_REF_PREFIX}/"]
+        lines = run_bash_cmd(cmd, interactive=False, remove_empty_lines=True)
+        for ref in (lines if isinstance(lines, list) else []):
+            namespace = ref[len(_GIT_CACHE_REF_PREFIX) + 1:].split("/", 1)[0]
+            if namespace not in keep_namespaces:
+                run_bash_cmd(["git", "-C", _GIT_CACHE_FULL_PATH, "update-ref", "-d", ref], interactive=False)
+    cmd = ["git", "-C", _GIT_CACHE_FULL_PATH, "gc", "-q", "--prune=now"]
+    if run_bash_cmd(cmd, interactive=False, return_lines=False, return_code=True) != 0:
+        _logger.error("Cache gc failed")
+    return size, get_path_size(_GIT_CACHE_FULL_PATH)
@@ -1,23 +1,99 @@
-from git.repo import Repo
-from git.exc import InvalidGitRepositoryError, NoSuchPathError
+import os
+import re
+import threading
+from typing import Optional
 from loytra_common import log_factory
-from loytra_common.utils import run_bash_cmd, check_if_path_exists, get_full_path, TCOL, remove_path
+from loytra_common.options import options
+from loytra_common.utils import run_bash_cmd, check_if_path_exists, get_full_path, TCOL, remove_path, parallel_map, get_millis, millis_passed, get_path_size
 from loytra_modules._util import get_loytra_parent_path
+from loytra_modules._git_cache import get_git_cache_clone_args, seed_git_cache
+from loytra_modules._module_registry import installed_module_registry
+from loytra_modules._pip_fingerprint import get_pip_fingerprint, read_pip_fingerprint, write_pip_fingerprint
+
+FETCH_MODE_FULL = "full"
+FETCH_MODE_SHALLOW = "shallow"
+FETCH_MODE_NEGOTIATE = "negotiate"
+FETCH_MODES = [FETCH_MODE_FULL, FETCH_MODE_SHALLOW, FETCH_MODE_NEGOTIATE]
+
+CLONE_STRATEGY_FULL = "full"
+CLONE_STRATEGY_SHALLOW = "shallow"
+CLONE_STRATEGY_BLOBLESS = "blobless"
+CLONE_STRATEGIES = [CLONE_STRATEGY_FULL, CLONE_STRATEGY_SHALLOW, CLONE_STRATEGY_BLOBLESS]
+DEEPEN_INITIAL_COMMITS = 50
+
+_COMMIT_SHA_RE = re.compile(r"[0-9a-f]{7,40}")
+
+
+_repos = {}
+_repos_lock = threading.Lock()
+_head_tags: dict[tuple[str, str], tuple[object, Optional[str]]] = {}
+
+
+def _open_repo(path):
+    # Repo objects read HEAD and refs on access, so one per path is reused across calls
+    path = get_full_path(path)
+    try:
+        # a removed and recloned repo gets a new .git inode and must not reuse the old object database
+        git_dir_ino = os.stat(f"{path}/.git").st_ino
+    except OSError:
+        git_dir_ino = None
+    with _repos_lock:
+        cached = _repos.get(path)
+        if cached is not None and git_dir_ino is not None and cached[0] == git_dir_ino:
+            return cached[1]
+        # gitpython is slow to import, load it only when a repo is actually opened
+        from git.repo import Repo
+        repo = Repo(path)
+        _repos[path] = (git_dir_ino, repo)
+        return repo
+
+
+def _parse_porcelain_status(lines) -> dict:
+    """Parses 'git status --porcelain=v2 --branch' output."""
+    status = {
+        "oid": None, "branch": None, "ahead": 0, "behind": 0,
+        "staged": False, "modified": False, "untracked": False,
+    }
+    for line in lines:
+        if line.startswith("# branch.oid "):
+            oid = line[13:].strip()
+            status["oid"] = oid if oid != "(initial)" else None
+        elif line.startswith("# branch.head "):
+            head = line[14:].strip()
+            status["branch"] = head if head != "(detached)" else None
+        elif line.startswith("# branch.ab "):
+            ahead, _, behind = line[12:].strip().partition(" ")
+            try:
+                status["ahead"], status["behind"] = int(ahead), -int(behind)
+            except ValueError:
+                pass
+        elif line[:2] in ["1 ", "2 ", "u "] and len(line) > 4:
+            # XY: index and work tree state, '.' for unchanged
+            status["staged"] = status["staged"] or line[2] != "."
+            status["modified"] = status["modified"] or line[3] != "."
+        elif line.startswith("? "):
+            status["untracked"] = True
+    return status
 
 
 class Moduler:
-    def __init__(self, package=None, module=None, url=None, hash=None, github_token=None):
+    def __init__(self, package=None, module=None, url=None, hash=None, github_token=None, clone_strategy=None):
         self.package = package
         self.module = module
         self.url = url
         self.hash = hash
         self.github_token = github_token
+        self.clone_strategy = clone_strategy
         self.install_location = self._get_install_location_from_url(self.url)
-        self.logger = log_factory.get(name="svs_moduler", tag="MODULER")
+
+    @property
+    def logger(self):
+        return log_factory.get(name="svs_moduler", tag="MODULER")
 
     def _is_repo(self, install_location):
+        from git.exc import InvalidGitRepositoryError, NoSuchPathError
         try:
-            Repo(get_full_path(install_location))
+            _open_repo(get_full_path(install_location))
             return True
         except (InvalidGitRepositoryError, NoSuchPathError):
             return False
@@ -25,68 +101,102 @@ class Moduler:
     def _get_github_token_interaction(self, github_token):
         return {"Username": ["", github_token][github_token != None], "Password": ""}
 
-    def _fetch_repo(self, install_location, github_token=None):
+    def _is_shallow_repo(self, install_location):
+        return check_if_path_exists(f"{get_full_path(install_location)}/.git/shallow")
+
+    def _get_fetch_cmd(self, install_location, mode=FETCH_MODE_FULL):
+        cmd = f"git -C {get_full_path(install_location)} fetch"
+        if mode == FETCH_MODE_SHALLOW:
+            # only the remote branch tips, full clones are fetched normally so they keep their history
+            if self._is_shallow_repo(install_location):
+                return f"{cmd} --depth 1"
+            return cmd
+        elif mode == FETCH_MODE_NEGOTIATE:
+            # checks remote reachability and credentials without downloading objects or updating refs
+            return f"{cmd} --negotiate-only --negotiation-tip=HEAD origin"
+        elif mode != FETCH_MODE_FULL:
+            raise RuntimeError(f"Unknown fetch mode {mode}, expected one of {FETCH_MODES}")
+        return cmd
+
+    def _fetch_repo(self, install_location, github_token=None, mode=FETCH_MODE_FULL):
         if not self._is_repo(install_location):
             return None
-        cmd = f"git -C {get_full_path(install_location)} fetch"
+        cmd = self._get_fetch_cmd(install_location, mode)
         interaction = self._get_github_token_interaction(github_token)
         return run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
 
-    def _get_git_tag(self, repo):
-        tag = next((tag for tag in repo.tags if tag.commit == repo.head.commit), None)
-        if tag:
-            return str(tag)
+    def _get_tag_refs_key(self, install_location):
+        git_dir = f"{get_full_path(install_location)}/.git"
+        key = []
+        for path in [f"{git_dir}/refs/tags", f"{git_dir}/packed-refs"]:
+            try:
+                key.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                key.append(None)
+        return tuple(key)
+
+    def _get_head_tag(self, install_location, oid) -> Optional[str]:
+        # cached per commit until a tag is added or removed
+        cache_key = (get_full_path(install_location), oid)
+        refs_key = self._get_tag_refs_key(install_location)
+        cached = _head_tags.get(cache_key)
+        if cached is not None and cached[0] == refs_key:
+            return cached[1]
+        lines = run_bash_cmd(["git", "-C", get_full_path(install_location), "tag", "--points-at", oid], interactive=False, remove_empty_lines=True)
+        tag = lines[0].strip() if isinstance(lines, list) and len(lines) > 0 else None
+        _head_tags[cache_key] = (refs_key, tag)
         return tag
 
+    def _get_git_tag(self, repo):
+        return self._get_head_tag(repo.working_dir, repo.head.commit.hexsha)
+
     def _get_git_branch_name(self, repo):
         if repo.head.is_detached:
             return None
         return repo.active_branch.name
 
-    def _get_git_sha(self, repo):
-        sha = repo.head.commit.hexsha
-        short_sha = repo.git.rev_parse(sha, short=7)
-        return short_sha
-
-    def _get_commits(self, repo, pattern):
-        return [c for c in repo.iter_commits(pattern)]
-
-    def _count_commits(self, repo, pattern):
-        return len(self._get_commits(repo, pattern))
-
     def _get_repo_local_version(self, repo):
-        tag = self._get_git_tag(repo)
         if not repo.head.is_detached:
             return self._get_git_branch_name(repo)
-        elif tag:
+        tag = self._get_git_tag(repo)
+        if tag:
             return tag
+        return repo.head.commit.hexsha[:7]
+
+    def _read_repo_status(self, install_location) -> Optional[dict]:
+        if not check_if_path_exists(f"{get_full_path(install_location)}/.git"):
+            return None
+        cmd = ["git", "-C", get_full_path(install_location), "status", "--porcelain=v2", "--branch"]
+        lines, ret_code = run_bash_cmd(cmd, interactive=False, return_code=True)
+        if ret_code != 0:
+            return None
+        status = _parse_porcelain_status(lines)
+        if status["branch"] is not None:
+            status["version"] = status["branch"]
+        elif status["oid"] is not None:
+            status["version"] = self._get_head_tag(install_location, status["oid"]) or status["oid"][:7]
         else:
-            return self._get_git_sha(repo)
+            status["version"] = None
+        return status
 
     def _get_repo_status(self, install_location, request_version=None, fetch_status=True):
-        if not self._is_repo(install_location):
+        repo_status = self._read_repo_status(install_location)
+        if repo_status is None:
             return None
         status = ""
-        repo = Repo(get_full_path(install_location))
-        branch = self._get_git_branch_name(repo)
-        is_git_repo_with_changes_to_be_committed = len(repo.index.diff("HEAD")) > 0
-        is_git_repo_modified = len(repo.index.diff(None)) > 0
-        is_git_repo_with_untracked_files = len(repo.untracked_files) > 0
-        is_git_repo_behind = bool(branch is not None and self._count_commits(repo, '%s..origin/%s' % (branch, branch)) > 0)
-        is_git_repo_ahead = bool(branch is not None and self._count_commits(repo, 'origin/%s..%s' % (branch, branch)) > 0)
-        repo_hash = self._get_repo_local_version(repo)
+        repo_hash = repo_status["version"]
 
         if request_version != None and repo_hash != request_version:
             status += "%s%s%s -> %s%s%s " % (TCOL.FAIL, repo_hash, TCOL.END, TCOL.FAIL, request_version, TCOL.END)
         else:
             status += "%s%s%s " % (TCOL.WARNING, repo_hash, TCOL.END)
 
-        status += ("", TCOL.HEADER + "B" + TCOL.END)[is_git_repo_behind]
-        status += ("", TCOL.HEADER + "A" + TCOL.END)[is_git_repo_ahead]
+        status += ("", TCOL.HEADER + "B" + TCOL.END)[repo_status["behind"] > 0]
+        status += ("", TCOL.HEADER + "A" + TCOL.END)[repo_status["ahead"] > 0]
 
-        status += ("", TCOL.OKBLUE + "M" + TCOL.END)[is_git_repo_modified]
-        status += ("", TCOL.OKBLUE + "S" + TCOL.END)[is_git_repo_with_changes_to_be_committed]
-        status += ("", TCOL.OKBLUE + "U" + TCOL.END)[is_git_repo_with_untracked_files]
+        status += ("", TCOL.OKBLUE + "M" + TCOL.END)[repo_status["modified"]]
+        status += ("", TCOL.OKBLUE + "S" + TCOL.END)[repo_status["staged"]]
+        status += ("", TCOL.OKBLUE + "U" + TCOL.END)[repo_status["untracked"]]
         status += ("", TCOL.FAIL + "F" + TCOL.END)[not fetch_status]
         return status.rstrip()
 
@@ -96,25 +206,78 @@ class Moduler:
     def _get_install_location_from_url(self, url):
         return f"{get_loytra_parent_path()}/{self._get_package_from_url(url)}"
 
+    def _get_clone_strategy(self):
+        clone_strategy = self.clone_strategy if self.clone_strategy is not None else options.clone_strategy
+        if clone_strategy not in CLONE_STRATEGIES:
+            raise RuntimeError(f"Unknown clone strategy {clone_strategy}, expected one of {CLONE_STRATEGIES}")
+        return clone_strategy
+
+    def _get_clone_url(self, url, github_token=None):
+        if "://" in url:
+            return url
+        github_token_str = ["", f"{github_token}@"][github_token != None]
+        return f"https://{github_token_str}{url}"
+
+    def _is_commit_sha(self, version):
+        return version is not None and _COMMIT_SHA_RE.fullmatch(version) is not None
+
+    def _get_clone_cmds(self, clone_url, install_location, request_version, clone_strategy):
+        git_clone = " ".join(filter(None, ["git clone", get_git_cache_clone_args()]))
+        if clone_strategy == CLONE_STRATEGY_BLOBLESS:
+            # full history, file contents are downloaded on checkout
+            return [f"{git_clone} --filter=blob:none {clone_url} {install_location}"]
+        elif clone_strategy == CLONE_STRATEGY_SHALLOW:
+            if request_version is None:
+                return [f"{git_clone} --depth 1 --single-branch {clone_url} {install_location}"]
+            elif self._is_commit_sha(request_version) and len(request_version) == 40:
+                # a commit can not be cloned by name, fetch just that commit into an empty repo
+                return [
+                    f"git init -q {install_location}",
+                    f"git -C {install_location} remote add origin {clone_url}",
+                    f"git -C {install_location} fetch --depth 1 origin {request_version}",
+                    f"git -C {install_location} checkout -q FETCH_HEAD",
+                ]
+            elif not self._is_commit_sha(request_version):
+                return [f"{git_clone} --depth 1 --single-branch --branch {request_version} {clone_url} {install_location}"]
+            # short hashes can not be fetched directly, checkout deepens the default branch until found
+            return [f"{git_clone} --depth 1 --single-branch {clone_url} {install_location}"]
+        return [f"{git_clone} {clone_url} {install_location}"]
+
+    def _run_clone_cmds(self, cmds) -> bool:
+        for cmd in cmds:
+            if run_bash_cmd(cmd, return_lines=False, return_code=True) != 0:
+                return False
+        return True
+
     def _clone_repo(self, url, request_version=None, github_token=None):
-        self.logger.info(f"clone_repo {github_token != None}@{url}@{request_version}")
+        clone_strategy = self._get_clone_strategy()
+        self.logger.info(f"clone_repo {github_token != None}@{url}@{request_version} ({clone_strategy})")
         install_location = self._get_install_location_from_url(url)
         if self._is_repo(install_location):
             return True
-        github_token_str = ["", f"{github_token}@"][github_token != None]
-        cmd = f"git clone https://{github_token_str}{url} {install_location}"
-        if run_bash_cmd(cmd, return_lines=False, return_code=True) == 0:
-            if request_version != None:
-                repo = Repo(self._get_install_location_from_url(url))
-                repo_hash = self._get_repo_local_version(repo)
-                if repo_hash != request_version:
-                    return self._checkout_repo(url, request_version, github_token)
-                else:
-                    return True
-            else:
-                return True
-        else:
+        timestamp = get_millis()
+        clone_url = self._get_clone_url(url, github_token)
+        success = self._run_clone_cmds(self._get_clone_cmds(clone_url, install_location, request_version, clone_strategy))
+        if not success and clone_strategy == CLONE_STRATEGY_SHALLOW:
+            # leave no half initialized repo behind, it would be taken as installed
+            remove_path(install_location)
+            if self._is_commit_sha(request_version) and len(request_version) == 40:
+                # servers refusing fetch by hash, clone the default branch and deepen it until the commit shows up
+                self.logger.info(f"  fetch of {request_version} refused, deepening the default branch instead")
+                success = self._run_clone_cmds(self._get_clone_cmds(clone_url, install_location, None, clone_strategy))
+                if not success:
+                    remove_path(install_location)
+        if not success:
             return False
+        self.logger.info(f"  cloned in {millis_passed(timestamp) / 1000:.1f} s, {get_path_size(install_location) / 1024 / 1024:.1f} MB on disk")
+        seed_git_cache(install_location, url)
+        if request_version != None:
+            repo = _open_repo(install_location)
+            repo_hash = self._get_repo_local_version(repo)
+            if repo_hash != request_version:
+                return self._checkout_repo(install_location, request_version, github_token) or \
+                    self._deepen_repo(install_location, request_version, github_token)
+        return True
 
     def _checkout_repo(self, install_location, request_version=None, github_token=None):
         self.logger.info(f"checkout_repo {github_token != None}@{install_location}@{request_version}")
@@ -122,6 +285,58 @@ class Moduler:
         interaction = self._get_github_token_interaction(github_token)
         return run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
 
+    def _deepen_repo(self, install_location, request_version, github_token=None):
+        """Fetches history into a shallow repo until request_version can be checked out."""
+        if request_version is None or not self._is_shallow_repo(install_location):
+            return False
+        timestamp = get_millis()
+        size = get_path_size(install_location)
+        interaction = self._get_github_token_interaction(github_token)
+        cmd_prefix = f"git -C {install_location}"
+        if not self._is_commit_sha(request_version):
+            # a branch also widens a single branch clone to keep tracking it, otherwise try a tag
+            branch_refspec = f"+refs/heads/{request_version}:refs/remotes/origin/{request_version}"
+            if run_bash_cmd(f"{cmd_prefix} fetch --depth 1 origin {branch_refspec}", interaction=interaction, return_lines=False, return_code=True) == 0:
+                run_bash_cmd(f"{cmd_prefix} remote set-branches --add origin {request_version}", return_lines=False, return_code=True)
+            else:
+                tag_refspec = f"+refs/tags/{request_version}:refs/tags/{request_version}"
+                run_bash_cmd(f"{cmd_prefix} fetch --depth 1 origin {tag_refspec}", interaction=interaction, return_lines=False, return_code=True)
+        elif len(request_version) == 40:
+            run_bash_cmd(f"{cmd_prefix} fetch --depth 1 origin {request_version}", interaction=interaction, return_lines=False, return_code=True)
+        success = self._checkout_repo(install_location, request_version, github_token)
+
+        # short hashes (or servers refusing fetch by hash) need the history, doubled each round
+        depth = DEEPEN_INITIAL_COMMITS
+        while not success and self._is_shallow_repo(install_location):
+            if run_bash_cmd(f"{cmd_prefix} fetch --deepen={depth}", interaction=interaction, return_lines=False, return_code=True) != 0:
+                break
+            success = self._checkout_repo(install_location, request_version, github_token)
+            depth *= 2
+        if not success and self._is_shallow_repo(install_location):
+            run_bash_cmd(f"{cmd_prefix} fetch --unshallow", interaction=interaction, return_lines=False, return_code=True)
+            success = self._checkout_repo(install_location, request_version, github_token)
+        self.logger.info(f"  deepened in {millis_passed(timestamp) / 1000:.1f} s, +{(get_path_size(install_location) - size) / 1024 / 1024:.1f} MB on disk")
+        return success
+
+    def _deepen_to_upstream(self, install_location, github_token=None) -> bool:
+        """Fetches history into a shallow repo until HEAD and its upstream share a merge base.
+
+        A --depth 1 fetch records the new upstream tip as another shallow root, merging it without
+        the commits in between is refused as unrelated histories.
+        """
+        git = ["git", "-C", get_full_path(install_location)]
+        if run_bash_cmd(git + ["rev-parse", "--verify", "-q", "@{upstream}"], interactive=False, return_lines=False, return_code=True) != 0:
+            return False
+        interaction = self._get_github_token_interaction(github_token)
+        depth = DEEPEN_INITIAL_COMMITS
+        while run_bash_cmd(git + ["merge-base", "HEAD", "@{upstream}"], interactive=False, return_lines=False, return_code=True) != 0:
+            if not self._is_shallow_repo(install_location):
+                return False
+            if run_bash_cmd(f"git -C {install_location} fetch --deepen={depth}", interaction=interaction, return_lines=False, return_code=True) != 0:
+                return False
+            depth *= 2
+        return True
+
     def _clean_repo(self, install_location):
         self.logger.info(f"clean_repo {install_location}")
         cmd = []
@@ -133,27 +348,40 @@ class Moduler:
             success_count += 1 if run_bash_cmd(c, return_lines=False, return_code=True) else 0
         return success_count == 0
 
-    def _pull_repo(self, install_location, github_token=None):
+    def _pull_repo(self, install_location, github_token=None, fetched=False):
         self.logger.info(f"pull_repo {github_token != None}@{install_location}")
+        if fetched:
+            # remote refs are already up to date, only the merge step of pull is left
+            if self._is_shallow_repo(install_location):
+                self._deepen_to_upstream(install_location, github_token)
+            cmd = ["git", "-C", get_full_path(install_location), "merge", "--no-edit", "@{upstream}"]
+            return run_bash_cmd(cmd, interactive=False, return_lines=False, return_code=True) == 0
         cmd = f"git -C {install_location} pull"
         interaction = self._get_github_token_interaction(github_token)
-        run_bash_cmd(cmd, interaction=interaction)
+        return run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
 
-    def _update_repo(self, install_location, request_version=None, github_token=None):
+    def _update_repo(self, install_location, request_version=None, github_token=None, fetched=False):
         self.logger.info(f"update_repo {github_token != None}@{install_location}@{request_version}")
-        repo = Repo(install_location)
+        repo = _open_repo(install_location)
+        success = True
         if repo:
-            if self._get_repo_local_version(repo) != request_version:
-                self._checkout_repo(install_location, request_version)
-            if self._get_repo_local_version(repo) != request_version:
-                self.logger.info(f"  Could not checkout, trying to fetch")
-                self._fetch_repo(install_location)
-                self._checkout_repo(install_location, request_version)
-            if self._get_repo_local_version(repo) != request_version:
-                self.logger.info(f"  Could not checkout, wrong hash or unclean repo")
+            if request_version is not None:
+                if self._get_repo_local_version(repo) != request_version:
+                    self._checkout_repo(install_location, request_version)
+                if self._get_repo_local_version(repo) != request_version and not fetched:
+                    self.logger.info(f"  Could not checkout, trying to fetch")
+                    self._fetch_repo(install_location)
+                    self._checkout_repo(install_location, request_version)
+                if self._get_repo_local_version(repo) != request_version and self._is_shallow_repo(install_location):
+                    self.logger.info(f"  Could not checkout, deepening shallow repo")
+                    self._deepen_repo(install_location, request_version, github_token)
+                if self._get_repo_local_version(repo) != request_version:
+                    self.logger.info(f"  Could not checkout, wrong hash or unclean repo")
+                    success = False
             if self._get_git_branch_name(repo):
-                self._pull_repo(install_location, github_token)
-        return None
+                success = self._pull_repo(install_location, github_token, fetched) and success
+            seed_git_cache(install_location, self.url)
+        return success
 
     def _remove_repo(self, install_location):
         self.logger.info(f"remove_repo {install_location}")
@@ -163,20 +391,22 @@ class Moduler:
     def is_installed(self):
         return self._is_installed_pip() and self._is_repo(self.install_location)
 
-    def install(self):
-        return self._clone_repo(self.url, self.hash, self.github_token) and self._install_pip_editable()
+    def install(self, force=False):
+        return self._clone_repo(self.url, self.hash, self.github_token) and self._install_pip_editable(force)
 
     def download_module(self):
         return self._clone_repo(self.url, self.hash, self.github_token)
 
-    def install_module(self):
-        return self._install_pip_editable()
+    def install_module(self, force=False):
+        return self._install_pip_editable(force)
 
     def uninstall(self):
+        write_pip_fingerprint(get_full_path(self.install_location), None)
         return self._uninstall_pip() and self._remove_repo(self.install_location)
 
     def _get_local_version(self):
-        return self._get_repo_local_version(Repo(self.install_location))
+        repo_status = self._read_repo_status(self.install_location)
+        return repo_status["version"] if repo_status is not None else None
 
     def get_status(self, fetch_status=True):
         repo_status = self._get_repo_status(self.install_location, self.hash, fetch_status=fetch_status)
@@ -186,37 +416,47 @@ class Moduler:
         else:
             return f"{repo_status} {pip_status}"
 
-    def fetch(self):
-        return self._fetch_repo(self.install_location, self.github_token)
+    def fetch(self, mode=None):
+        """Fetches the remote, mode is one of FETCH_MODES and defaults to options.fetch_mode."""
+        return self._fetch_repo(self.install_location, self.github_token, mode if mode is not None else options.fetch_mode)
 
-    def _install_pip_editable(self):
+    def _install_pip_editable(self, force=False):
         if self.module == None:
             return True
+        install_location = get_full_path(self.install_location)
+        # nothing pip would do differently when the packaging files and installed dependencies are unchanged
+        if not force and self._is_installed_pip() and \
+                read_pip_fingerprint(install_location) == get_pip_fingerprint(install_location, self.package, self.module):
+            self.logger.info(f"pip install skipped, {self.package} unchanged")
+            return True
         # cmd = f"pip install -e {self.install_location}"
         cmd = f"pip install --prefix=$(python -m site --user-base) --editable {self.install_location}"
-        return run_bash_cmd(cmd, return_lines=False, return_code=True) == 0
+        success = run_bash_cmd(cmd, return_lines=False, return_code=True) == 0
+        installed_module_registry.invalidate()
+        write_pip_fingerprint(install_location, get_pip_fingerprint(install_location, self.package, self.module) if success else None)
+        return success
 
-    def update(self, request_version=None):
-        return self._update_repo(self.install_location, request_version, self.github_token) and self._install_pip_editable()
+    def update(self, request_version=None, fetched=False, force=False):
+        """Updates the checkout, pip install runs only when the packaging fingerprint changed (or force).
+
+        fetched=True skips network access, remote refs must be fetched beforehand (see fetch_modulers).
+        """
+        success = self._update_repo(self.install_location, request_version, self.github_token, fetched)
+        return self._install_pip_editable(force) and success
 
     def _is_installed_pip(self):
         if self.module == None:
             return True
-        # reload sys.path
-        import site
-        from importlib import reload
-        reload(site)
-
-        # check if module is in sys.path
-        from importlib import util as imput
-        return imput.find_spec(self.module) is not None
+        return installed_module_registry.is_installed(self.module)
 
     def _uninstall_pip(self):
         if self.module == None:
             return True
         cmd = f"pip uninstall {self.package}"
         interaction = {"Proceed (": "y"}
-        return run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
+        success = run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
+        installed_module_registry.invalidate()
+        return success
 
     def _get_status_pip(self):
         if self.module == None:
@@ -227,6 +467,14 @@ class Moduler:
         self._clean_repo(self.install_location)
 
 
+def fetch_modulers(modulers: list[Moduler], limit: Optional[int] = None, mode=None) -> list[Optional[bool]]:
+    """Fetch all module repos concurrently, returns fetch results in modulers order.
+
+    Every git process opens its own connection, the limit bounds how many handshakes run at once.
+    """
+    return parallel_map(modulers, lambda moduler: moduler.fetch(mode), limit=limit)
+
+
 if __name__ == "__main__":
     import readline
     import code
@@ -1,49 +1,196 @@
+import asyncio
+import threading
+from contextlib import nullcontext
+from typing import Callable, Optional
 from loytra_common import log_factory
-from loytra_common.utils import run_bash_cmd, TCOL, write_lines_to_file, read_lines_from_file, check_if_path_exists, get_full_path, get_linux_password
+from loytra_common.options import options
+from loytra_common.utils import run_bash_cmd, TCOL, write_lines_to_file, read_lines_from_file, check_if_path_exists, get_full_path, get_linux_password, terminal_lock
+from loytra_modules._module_registry import installed_module_registry
+from loytra_modules._package_index import pacman_package_index, dpkg_package_index, apk_package_index
 import os
 import stat
-import re
+import shutil
+
+
+def _get_mtime_key(path) -> int:
+    try:
+        return os.stat(get_full_path(path)).st_mtime_ns
+    except OSError:
+        return -1
 
 
 class Packager:
     def __init__(self, name: str):
         self.name = name
-        self.logger = log_factory.get(name=f"svs_packager_{self.name}", tag=f"PACKAGER:{self.name}")
+        self._sync_state: Optional[tuple[object, bool]] = None
+
+    @property
+    def logger(self):
+        return log_factory.get(name=f"svs_packager_{self.name}", tag=f"PACKAGER:{self.name}")
+
+    def get_sync_state_key(self) -> Optional[object]:
+        """Value which changes whenever the sync state may have changed, None disables caching."""
+        return None
+
+    def invalidate_sync_state(self):
+        self._sync_state = None
 
     def is_sync(self) -> bool:
-        return False
+        key = self.get_sync_state_key()
+        sync_state = self._sync_state
+        if key is not None and sync_state is not None and sync_state[0] == key:
+            return sync_state[1]
+        result = self._is_sync()
+        self._sync_state = (key, result) if key is not None else None
+        return result
 
     def sync(self) -> bool:
-        return False
+        # the lock is taken where the backend command runs, composite packagers only delegate here
+        with _get_packager_lock(self.get_lock_key()):
+            try:
+                return self._sync()
+            finally:
+                self.invalidate_sync_state()
 
     def unsync(self) -> bool:
+        with _get_packager_lock(self.get_lock_key()):
+            try:
+                return self._unsync()
+            finally:
+                self.invalidate_sync_state()
+
+    def _is_sync(self) -> bool:
+        return False
+
+    def _sync(self) -> bool:
+        return False
+
+    def _unsync(self) -> bool:
         return False
 
     def get_status(self) -> str:
         return ""
 
+    def is_batchable(self) -> bool:
+        """True when sync can be merged with others of the same type through sync_many."""
+        return False
+
+    def get_lock_key(self) -> Optional[str]:
+        """Packagers with the same lock key never sync concurrently (e.g. same package manager)."""
+        return None
+
+    @classmethod
+    def sync_many(cls, packagers: list["Packager"]) -> bool:
+        all_success = True
+        for packager in packagers:
+            if not packager.sync():
+                all_success = False
+        return all_success
+
+
+_packager_locks: dict[str, threading.RLock] = {}
+_packager_locks_lock = threading.Lock()
+
+
+def _get_packager_lock(lock_key: Optional[str]):
+    if lock_key is None:
+        return nullcontext()
+    with _packager_locks_lock:
+        return _packager_locks.setdefault(lock_key, threading.RLock())
+
+
+class _PackagerGraphExecutor:
+    """Runs an action over packagers in dependency order, independent steps concurrently.
+
+    Leaf packagers sharing a lock key (see Packager.get_lock_key) serialize their own sync/unsync
+    process wide, also when they are reached through a MultiPackager or a nested group.
+    """
+
+    def __init__(self, packagers: list[Packager], dependencies: dict[str, list[str]]):
+        self.packagers = packagers
+        indexes = { p.name: i for i, p in enumerate(packagers) }
+        self.dependencies: list[list[int]] = [[] for _ in packagers]
+        for name, depends_on in dependencies.items():
+            if name not in indexes:
+                raise RuntimeError(f"Unknown packager '{name}' in dependencies!")
+            for dependency in depends_on:
+                if dependency not in indexes:
+                    raise RuntimeError(f"Unknown packager dependency '{dependency}' of '{name}'!")
+            self.dependencies[indexes[name]] = [indexes[d] for d in depends_on]
+        self._check_cycles()
+
+    def _check_cycles(self):
+        state: dict[int, int] = {}
+
+        def visit(i):
+            if state.get(i) == 1:
+                raise RuntimeError(f"Packager dependency cycle at '{self.packagers[i].name}'!")
+            if state.get(i) == 2:
+                return
+            state[i] = 1
+            for dependency in self.dependencies[i]:
+                visit(dependency)
+            state[i] = 2
+
+        for i in range(len(self.packagers)):
+            visit(i)
+
+    def _get_waits(self, reverse) -> list[list[int]]:
+        if not reverse:
+            return self.dependencies
+        # undo dependents before what they depend on
+        dependents: list[list[int]] = [[] for _ in self.packagers]
+        for i, depends_on in enumerate(self.dependencies):
+            for dependency in depends_on:
+                dependents[dependency].append(i)
+        return dependents
+
+    async def _run_async(self, action: Callable[[Packager], bool], reverse: bool) -> bool:
+        waits = self._get_waits(reverse)
+        loop = asyncio.get_running_loop()
+        results: list[asyncio.Future] = [loop.create_future() for _ in self.packagers]
+        semaphore = asyncio.Semaphore(options.jobs)
+
+        def run_step(packager: Packager):
+            # the action reports success itself, not every packager can read back its effect in this process
+            return bool(action(packager))
+
+        async def step(i):
+            packager = self.packagers[i]
+            success = False
+            try:
+                dependencies_ok = [await results[d] for d in waits[i]]
+                if all(dependencies_ok):
+                    async with semaphore:
+                        success = await asyncio.to_thread(run_step, packager)
+                else:
+                    packager.logger.error("skipped, a dependency failed")
+            finally:
+                results[i].set_result(success)
+
+        await asyncio.gather(*[step(i) for i in range(len(self.packagers))])
+        return all(f.result() for f in results)
+
+    def run(self, action: Callable[[Packager], bool], reverse: bool = False) -> bool:
+        return asyncio.run(self._run_async(action, reverse))
+
 
 class PackagerGroup(Packager):
-    def __init__(self, name: str, children: list[Packager]):
+    def __init__(self, name: str, children: list[Packager], dependencies: Optional[dict[str, list[str]]] = None):
+        """dependencies maps a child name to the names of children which must be synced before it."""
         super().__init__(name)
         self.children = children
+        self.dependencies = dependencies if dependencies is not None else {}
+        self._executor = _PackagerGraphExecutor(self.children, self.dependencies)
 
     def is_sync(self) -> bool:
-        return all([c.is_sync() for c in self.children])
+        return all(c.is_sync() for c in self.children)
 
     def sync(self) -> bool:
-        all_success = True
-        for c in self.children:
-            if not c.sync():
-                all_success = False
-        return all_success
+        return self._executor.run(lambda c: c.sync())
 
     def unsync(self) -> bool:
-        all_success = True
-        for c in self.children:
-            if not c.unsync():
-                all_success = False
-        return all_success
+        return self._executor.run(lambda c: c.unsync(), reverse=True)
 
     def get_status(self) -> str:
         return super().get_status()
@@ -54,19 +201,26 @@ class PackagerUserGroup(Packager):
         super().__init__(name)
         self.group = group
 
-    def sync(self):
+    def get_lock_key(self) -> Optional[str]:
+        return "user_groups"
+
+    def get_sync_state_key(self) -> Optional[object]:
+        # 'groups' reports the groups of this process, fixed at login, not the current /etc/group
+        return tuple(os.getgroups())
+
+    def _sync(self):
         cmd = f"sudo gpasswd -a $USER {self.group}"
         ret_code = run_bash_cmd(cmd, return_lines=False, return_code=True)
         self.logger.info("Reboot or logout for changes to take efect!")
         return ret_code == 0
 
-    def unsync(self):
+    def _unsync(self):
         cmd = f"sudo gpasswd -d $USER {self.group}"
         ret_code = run_bash_cmd(cmd, return_lines=False, return_code=True)
         self.logger.info("Reboot or logout for changes to take efect!")
         return ret_code == 0
 
-    def is_sync(self):
+    def _is_sync(self):
         cmd = "groups"
         lines = run_bash_cmd(cmd)
         if isinstance(lines, list) and len(lines) == 1:
@@ -90,6 +244,13 @@ class PackagerExecToPath(Packager):
         self.path = path
         self.env_file = env_file
 
+    def get_lock_key(self) -> Optional[str]:
+        return f"file:{get_full_path(self.env_file)}"
+
+    def get_sync_state_key(self) -> Optional[object]:
+        path = os.environ.get("PATH", "")
+        return (path, tuple(_get_mtime_key(p) for p in path.split(os.pathsep) if len(p) > 0))
+
     def generate_path_line(self):
         return f"export PATH=$PATH:{self.path}"
 
@@ -106,7 +267,7 @@ class PackagerExecToPath(Packager):
         self.logger.info("Restart the terminal for changes to take efect!")
         return True
 
-    def sync(self):
+    def _sync(self):
         self.add_and_remove_lines_from_file(self.env_file, lines_to_add=[self.generate_path_line()])
         if not self.is_exec_executable():
             full_path = get_full_path(f"{self.path}/{self.exec}")
@@ -114,16 +275,15 @@ class PackagerExecToPath(Packager):
             os.chmod(full_path, st.st_mode | stat.S_IEXEC)
         return True
 
-    def unsync(self):
+    def _unsync(self):
         return self.add_and_remove_lines_from_file(self.env_file, lines_to_remove=[self.generate_path_line()])
 
     def is_exec_executable(self):
         full_path = get_full_path(f"{self.path}/{self.exec}")
         return os.access(full_path, os.X_OK)
 
-    def is_sync(self):
-        import distutils.spawn
-        return distutils.spawn.find_executable(self.exec) is not None
+    def _is_sync(self):
+        return shutil.which(self.exec) is not None
 
     def is_ready_for_usage(self):
         return self.is_sync() and self.is_exec_executable()
@@ -146,22 +306,25 @@ class PackagerFileCreator(Packager):
         self.line = line
         self.sudo = sudo
 
+    def get_sync_state_key(self) -> Optional[object]:
+        return _get_mtime_key(self.path)
+
     def get_sudo_interaction(self):
         interaction = {}
         if self.sudo:
             interaction["[sudo]"] = get_linux_password()
         return interaction
 
-    def sync(self):
+    def _sync(self):
         cmd = f"echo '{self.line}' | {['', 'sudo '][self.sudo]}tee {self.path}"
         ret_code = run_bash_cmd(cmd, interaction=self.get_sudo_interaction(), return_lines=False, return_code=True)
-        return ret_code
+        return ret_code == 0
 
-    def unsync(self):
+    def _unsync(self):
         cmd = f"{['', 'sudo '][self.sudo]}rm {self.path}"
-        return run_bash_cmd(cmd, interaction=self.get_sudo_interaction(), return_lines=False, return_code=True)
+        return run_bash_cmd(cmd, interaction=self.get_sudo_interaction(), return_lines=False, return_code=True) == 0
 
-    def is_sync(self):
+    def _is_sync(self):
         try:
             lines = read_lines_from_file(self.path)
             if len(lines) == 1 and self.line in lines[0]:
@@ -178,56 +341,21 @@ class PackagerUdevRule(PackagerFileCreator):
     def __init__(self, name: str, path, line):
         super().__init__(name, path, line, sudo=True)
 
-    def sync(self):
-        super().sync()
+    def _sync(self):
+        success = super()._sync()
         self.logger.info("Reboot or logout for changes to take efect!")
+        return success
 
 
 class PackagerRepoPacman(Packager):
     def __init__(self, name: str, package_name):
         super().__init__(name)
-        self.sl = []
-        self.qi = []
         self.repo = package_name.split("/")[0]
         self.package = package_name.split("/")[1]
 
-    def get_sl(self):
-        if len(self.sl) == 0:
-            lines = run_bash_cmd("/usr/bin/pacman --color never -Sl")
-            if lines is not None and isinstance(lines, list):
-                self.sl = lines
-        return self.sl
-
-    def get_qi(self):
-        if len(self.qi) == 0:
-            lines = run_bash_cmd("/usr/bin/pacman --color never -Qi")
-            if lines is not None and isinstance(lines, list):
-                self.qi = lines
-        return self.qi
-
-    def is_sync(self):
-        re_sl = re.compile(r"^(\S+)\s(\S+)\s(.*)$")
-        for line in self.get_sl():
-            # some lines look like this ['\x1b', '[', '?', '2', '5', 'h']
-            try:
-                m = re_sl.match(line)
-                if m is not None:
-                    g = m.groups()
-                    if g[0] == self.repo and g[1] == self.package and "installed" in g[2]:
-                        return True
-            except:
-                pass
-        re_qi = re.compile(r"^Name\s+:\s(\S+)$")
-        for line in self.get_qi():
-            try:
-                m = re_qi.match(line)
-                if m is not None:
-                    g = m.groups()
-                    if g is not None and len(g) > 0 and g[0] == self.package:
-                        return True
-            except:
-                pass
-        return False
+    def _is_sync(self):
+        # the local db does not record the sync repo, any installed package with this name counts
+        return pacman_package_index.is_installed(self.package)
 
     def install_aur_package(self):
         cmds = [
@@ -242,9 +370,12 @@ class PackagerRepoPacman(Packager):
         }
         for cmd in cmds:
             run_bash_cmd(cmd, interaction=interaction)
+        # makepkg output is not reliable, the local db tells whether the package landed
+        return pacman_package_index.is_installed(self.package)
 
-    def install_repo_package(self):
-        cmd = f"sudo pacman -S {self.package}"
+    @staticmethod
+    def _install_repo_packages(packages, logger):
+        cmd = f"sudo pacman -S {' '.join(packages)}"
         interaction = {
             "Proceed with installation": "Y",
             "are in conflict. Remove": "y",
@@ -256,15 +387,33 @@ class PackagerRepoPacman(Packager):
                 if "error" in line:
                     success = False
         if not success:
-            self.logger.error(f"cant install, try manually: {TCOL.WARNING}{cmd}{TCOL.END}")
+            logger.error(f"cant install, try manually: {TCOL.WARNING}{cmd}{TCOL.END}")
+        return success
 
-    def sync(self):
+    def install_repo_package(self):
+        return self._install_repo_packages([self.package], self.logger)
+
+    def get_sync_state_key(self) -> Optional[object]:
+        return pacman_package_index.get_key()
+
+    def get_lock_key(self) -> Optional[str]:
+        return "repo"
+
+    def is_batchable(self) -> bool:
+        return self.repo != "aur"
+
+    @classmethod
+    def sync_many(cls, packagers: list["PackagerRepoPacman"]) -> bool:
+        if len(packagers) == 0:
+            return True
+        return cls._install_repo_packages([p.package for p in packagers], packagers[0].logger)
+
+    def _sync(self):
         if self.repo == "aur":
-            self.install_aur_package()
-        else:
-            self.install_repo_package()
+            return self.install_aur_package()
+        return self.install_repo_package()
 
-    def unsync(self):
+    def _unsync(self):
         if self.is_sync():
             cmd = f"sudo pacman -Rs {self.package}"
             interaction = {
@@ -279,6 +428,8 @@ class PackagerRepoPacman(Packager):
                         success = False
             if not success:
                 self.logger.error(f"cant remove, try manually: {TCOL.WARNING}{cmd}{TCOL.END}")
+            return success
+        return True
 
     def get_status(self):
         return f"{(TCOL.FAIL, TCOL.OKGREEN)[self.is_sync()]}{self.repo}/{self.package}{TCOL.END}"
@@ -293,16 +444,10 @@ class PackagerRepoApt(Packager):
         super().__init__(name)
         self.package_name = package_name
 
-    def is_sync(self):
-        cmd = f"dpkg -s {self.package_name}"
-        lines = run_bash_cmd(cmd)
-        if lines is not None and isinstance(lines, list):
-            for line in lines:
-                if "Status: install ok installed" in line:
-                    return True
-        return False
+    def _is_sync(self):
+        return dpkg_package_index.is_installed(self.package_name)
 
-    def sync(self):
+    def _sync(self):
         cmd = f"sudo apt install {self.package_name}"
         interaction = {
             "Do you want to continue? [Y/n]": "Y"
@@ -316,7 +461,29 @@ class PackagerRepoApt(Packager):
         self.logger.error(f"cant install, try manually: {TCOL.WARNING}{cmd}{TCOL.END}")
         return False
 
-    def unsync(self):
+    def get_sync_state_key(self) -> Optional[object]:
+        return dpkg_package_index.get_key()
+
+    def get_lock_key(self) -> Optional[str]:
+        return "repo"
+
+    def is_batchable(self) -> bool:
+        return True
+
+    @classmethod
+    def sync_many(cls, packagers: list["PackagerRepoApt"]) -> bool:
+        if len(packagers) == 0:
+            return True
+        cmd = f"sudo apt install {' '.join(p.package_name for p in packagers)}"
+        interaction = {
+            "Do you want to continue? [Y/n]": "Y"
+        }
+        ret_code = run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True)
+        if ret_code != 0:
+            packagers[0].logger.error(f"cant install, try manually: {TCOL.WARNING}{cmd}{TCOL.END}")
+        return ret_code == 0
+
+    def _unsync(self):
         if self.is_sync():
             cmd = f"sudo apt purge {self.package_name}"
             interaction = {
@@ -329,6 +496,7 @@ class PackagerRepoApt(Packager):
                         return True
             self.logger.error(f"cant remove, try manually: {TCOL.WARNING}{cmd}{TCOL.END}")
             return False
+        return True
 
     def get_status(self):
         return f"{(TCOL.FAIL, TCOL.OKGREEN)[self.is_sync()]}{self.package_name}{TCOL.END}"
@@ -343,14 +511,10 @@ class PackagerRepoApk(Packager):
         super().__init__(name)
         self.package_name = package_name
 
-    def is_sync(self):
-        cmd = f"apk list -I {self.package_name}"
-        lines = run_bash_cmd(cmd)
-        if lines is not None and isinstance(lines, list) and len(lines) == 1 and self.package_name in lines[0]:
-            return True
-        return False
+    def _is_sync(self):
+        return apk_package_index.is_installed(self.package_name)
 
-    def sync(self):
+    def _sync(self):
         cmd = f"apk add {self.package_name}"
         lines = run_bash_cmd(cmd)
         for line in lines:
@@ -358,7 +522,23 @@ class PackagerRepoApk(Packager):
                 return True
         return False
 
-    def unsync(self):
+    def get_sync_state_key(self) -> Optional[object]:
+        return apk_package_index.get_key()
+
+    def get_lock_key(self) -> Optional[str]:
+        return "repo"
+
+    def is_batchable(self) -> bool:
+        return True
+
+    @classmethod
+    def sync_many(cls, packagers: list["PackagerRepoApk"]) -> bool:
+        if len(packagers) == 0:
+            return True
+        cmd = f"apk add {' '.join(p.package_name for p in packagers)}"
+        return run_bash_cmd(cmd, return_lines=False, return_code=True) == 0
+
+    def _unsync(self):
         cmd = f"apk del {self.package_name}"
         lines = run_bash_cmd(cmd)
         for line in lines:
@@ -374,18 +554,45 @@ class PackagerRepoApk(Packager):
         return check_if_path_exists("/sbin/apk")
 
 
+_package_manager_class = None
+
+
+def get_package_manager_class():
+    """Detects the system package manager once per process."""
+    global _package_manager_class
+    if _package_manager_class is None:
+        for packager_class in (PackagerRepoPacman, PackagerRepoApt, PackagerRepoApk):
+            if packager_class.is_valid():
+                _package_manager_class = packager_class
+                break
+    return _package_manager_class
+
+
 class PackagerRepo(Packager):
     def __init__(self, name: str, pacman_package_name: str, apt_package_name: str, apk_package_name):
         super().__init__(name)
-        if PackagerRepoPacman.is_valid():
-            self.package_manager = PackagerRepoPacman(name, pacman_package_name)
-        elif PackagerRepoApt.is_valid():
-            self.package_manager = PackagerRepoApt(name, apt_package_name)
-        elif PackagerRepoApk.is_valid():
-            self.package_manager = PackagerRepoApk(name, apk_package_name)
-        else:
-            self.logger.error("No package manager found!")
-            raise RuntimeError("No package manager found!")
+        self.pacman_package_name = pacman_package_name
+        self.apt_package_name = apt_package_name
+        self.apk_package_name = apk_package_name
+        self._package_manager = None
+
+    @property
+    def package_manager(self) -> Packager:
+        if self._package_manager is None:
+            package_manager_class = get_package_manager_class()
+            if package_manager_class is PackagerRepoPacman:
+                self._package_manager = PackagerRepoPacman(self.name, self.pacman_package_name)
+            elif package_manager_class is PackagerRepoApt:
+                self._package_manager = PackagerRepoApt(self.name, self.apt_package_name)
+            elif package_manager_class is PackagerRepoApk:
+                self._package_manager = PackagerRepoApk(self.name, self.apk_package_name)
+            else:
+                self.logger.error("No package manager found!")
+                raise RuntimeError("No package manager found!")
+        return self._package_manager
+
+    def get_lock_key(self) -> Optional[str]:
+        return self.package_manager.get_lock_key()
 
     def is_sync(self):
         return self.package_manager.is_sync()
@@ -412,20 +619,24 @@ class MultiPackager(Packager):
         return False
 
     def sync(self) -> bool:
-        print(f"{TCOL.BOLD}{self.name}{TCOL.END}")
-        for e, packager in enumerate(self.packagers):
-            print(f"  [{e}] {packager.name}")
-        try:
-            return self.packagers[int(input("select number to install: "))].sync()
-        except Exception as e:
-            print(f"ERROR: cant install with {e}")
-            return False
+        # only the prompt holds the terminal, the selected packager may prompt for the sudo password itself
+        with terminal_lock:
+            print(f"{TCOL.BOLD}{self.name}{TCOL.END}")
+            for e, packager in enumerate(self.packagers):
+                print(f"  [{e}] {packager.name}")
+            try:
+                packager = self.packagers[int(input("select number to install: "))]
+            except Exception as e:
+                print(f"ERROR: cant install with {e}")
+                return False
+        return packager.sync()
 
     def unsync(self) -> bool:
+        all_success = True
         for packager in self.packagers:
-            if packager.is_sync():
-                packager.unsync()
-        return True
+            if packager.is_sync() and not packager.unsync():
+                all_success = False
+        return all_success
 
     def get_status(self) -> str:
         statuses = []
@@ -441,19 +652,43 @@ class PackagerPip(Packager):
         self.package = package
         self.module = module
 
-    def is_sync(self) -> bool:
-        from importlib import util as imput
-        return imput.find_spec(self.module) is not None
+    def _is_sync(self) -> bool:
+        return installed_module_registry.is_installed(self.module)
 
-    def sync(self) -> bool:
+    def _sync(self) -> bool:
         cmd = f"pip install {self.package}"
         interaction = {"Proceed (": "y"}
-        return run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
+        success = run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
+        installed_module_registry.invalidate()
+        return success
 
-    def unsync(self) -> bool:
+    def get_sync_state_key(self) -> Optional[object]:
+        # site dirs change mtime whenever a distribution is added or removed
+        return installed_module_registry.get_key()
+
+    def get_lock_key(self) -> Optional[str]:
+        return "pip"
+
+    def is_batchable(self) -> bool:
+        return True
+
+    @classmethod
+    def sync_many(cls, packagers: list["PackagerPip"]) -> bool:
+        if len(packagers) == 0:
+            return True
+        cmd = f"pip install {' '.join(p.package for p in packagers)}"
+        interaction = {"Proceed (": "y"}
+        success = run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
+        # new packages are not visible to find_spec until sys.path and the path finder caches are rebuilt
+        installed_module_registry.invalidate()
+        return success
+
+    def _unsync(self) -> bool:
         cmd = f"pip uninstall {self.package}"
         interaction = {"Proceed (": "y"}
-        return run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
+        success = run_bash_cmd(cmd, interaction=interaction, return_lines=False, return_code=True) == 0
+        installed_module_registry.invalidate()
+        return success
 
     def get_status(self) -> str:
         return [f"{TCOL.FAIL}pip{TCOL.END}", f"{TCOL.OKGREEN}PIP{TCOL.END}"][self.is_sync()]
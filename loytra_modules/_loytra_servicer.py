@@ -1,6 +1,12 @@
 import re
+import threading
+from contextlib import contextmanager
+from time import sleep
+from typing import Optional
 from loytra_common import log_factory
 from loytra_common.utils import *
+from loytra_modules._systemd_dbus import systemd_dbus_call
+from loytra_modules._service_notify import EXPLICIT_READY_ENV
 
 ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 SYSTEMD_CONFIG_USER_PATH = "~/.config/systemd/user"
@@ -16,6 +22,7 @@ SYSTEMD_SERVICE_TEMPLATE = [
     "ExecStartPre=",
     "ExecStart=",
     "TimeoutStopSec=2",
+    "WatchdogSec=",
     "",
     "Restart=always",
     "RestartSec=1",
@@ -23,6 +30,194 @@ SYSTEMD_SERVICE_TEMPLATE = [
     "[Install]",
     "WantedBy=default.target"
 ]
+SYSTEMD_STATE_PROPERTIES = ["Id", "LoadState", "ActiveState", "SubState", "UnitFileState", "ActiveEnterTimestampMonotonic"]
+SYSTEMD_STATE_CACHE_TTL_MS = 2000
+SYSTEMD_RESTART_TIMEOUT_MS = 30000
+SYSTEMD_RESTART_POLL_INTERVAL_S = 0.1
+SYSTEMD_ENABLED_UNIT_FILE_STATES = ["enabled", "enabled-runtime", "static", "indirect", "generated", "transient", "alias"]
+
+
+class _SystemdStateCache:
+    """Short lived unit state cache shared by all servicers in the process."""
+
+    def __init__(self, ttl_ms=SYSTEMD_STATE_CACHE_TTL_MS):
+        self._ttl_ms = ttl_ms
+        self._lock = threading.Lock()
+        self._states: dict[tuple[bool, str], tuple[int, dict[str, str]]] = {}
+
+    def get(self, is_user_unit, name) -> Optional[dict[str, str]]:
+        with self._lock:
+            entry = self._states.get((is_user_unit, name))
+        if entry is None or millis_passed(entry[0]) > self._ttl_ms:
+            return None
+        return entry[1]
+
+    def update(self, is_user_unit, states: dict[str, dict[str, str]]):
+        timestamp = get_millis()
+        with self._lock:
+            for name, state in states.items():
+                self._states[(is_user_unit, name)] = (timestamp, state)
+
+    def invalidate(self, is_user_unit=None, name=None):
+        with self._lock:
+            for key in list(self._states.keys()):
+                if (is_user_unit is None or key[0] == is_user_unit) and (name is None or key[1] == name):
+                    del self._states[key]
+
+
+_systemd_state_cache = _SystemdStateCache()
+
+
+def _parse_systemd_show_output(names, lines) -> dict[str, dict[str, str]]:
+    # units are printed in request order, a repeated property starts the next unit
+    blocks: list[dict[str, str]] = []
+    for line in lines:
+        key, sep, value = ANSI_ESCAPE.sub('', line).strip().partition("=")
+        if not sep or key not in SYSTEMD_STATE_PROPERTIES:
+            continue
+        if len(blocks) == 0 or key in blocks[-1]:
+            blocks.append({})
+        blocks[-1][key] = value
+
+    result: dict[str, dict[str, str]] = {}
+    if len(blocks) == len(names):
+        for name, block in zip(names, blocks):
+            result[name] = block
+    else:
+        for block in blocks:
+            if block.get("Id") in names:
+                result[block["Id"]] = block
+    return result
+
+
+def query_systemd_states(is_user_unit, names) -> dict[str, dict[str, str]]:
+    """Fetches the state properties of all given units with a single systemctl call."""
+    names = list(dict.fromkeys(names))
+    if len(names) == 0:
+        return {}
+    states = systemd_dbus_call(is_user_unit, lambda m: m.get_unit_states(names, SYSTEMD_STATE_PROPERTIES))
+    if states is None:
+        systemctl = "systemctl --user" if is_user_unit else "systemctl"
+        cmd = f"{systemctl} show -p {','.join(SYSTEMD_STATE_PROPERTIES)} {' '.join(names)}"
+        lines = run_bash_cmd(cmd, remove_empty_lines=True)
+        if lines is None or not isinstance(lines, list):
+            lines = []
+        states = _parse_systemd_show_output(names, lines)
+    _systemd_state_cache.update(is_user_unit, states)
+    return states
+
+
+class _SystemdReloadBatch:
+    """Defers daemon-reloads while a batch is open, one reload per manager when it closes.
+
+    A pending reload is flushed before any unit action on the same manager so actions never see
+    stale unit files.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._pending: set[bool] = set()
+
+    def enter(self):
+        with self._lock:
+            self._depth += 1
+
+    def exit(self):
+        with self._lock:
+            self._depth -= 1
+            is_last = self._depth == 0
+        if is_last:
+            self.flush()
+
+    def defer(self, is_user_unit) -> bool:
+        """Returns True when the reload was deferred to the end of the batch."""
+        with self._lock:
+            if self._depth == 0:
+                return False
+            self._pending.add(is_user_unit)
+            return True
+
+    def flush(self, is_user_unit=None):
+        with self._lock:
+            targets = [u for u in self._pending if is_user_unit is None or u == is_user_unit]
+            self._pending.difference_update(targets)
+        for target in targets:
+            _systemd_daemon_reload_now(target)
+
+
+def _systemd_daemon_reload_now(is_user_unit):
+    if systemd_dbus_call(is_user_unit, lambda m: m.reload(), is_action=True) is None:
+        cmd = f"{'systemctl --user' if is_user_unit else 'sudo systemctl'} daemon-reload"
+        run_bash_cmd(cmd)
+    _systemd_state_cache.invalidate(is_user_unit)
+
+
+_systemd_reload_batch = _SystemdReloadBatch()
+
+
+@contextmanager
+def systemd_reload_batch():
+    """Unit files installed inside share a single daemon-reload per systemd manager."""
+    _systemd_reload_batch.enter()
+    try:
+        yield
+    finally:
+        _systemd_reload_batch.exit()
+
+
+def prefetch_systemd_states(servicers):
+    """Loads the state cache for all given servicers, one systemctl call per user/system manager."""
+    for is_user_unit in (True, False):
+        names = [s._name for s in servicers if s._is_user_unit == is_user_unit]
+        query_systemd_states(is_user_unit, names)
+
+
+def restart_systemd_units(is_user_unit, names, timeout_ms=SYSTEMD_RESTART_TIMEOUT_MS) -> dict[str, Optional[int]]:
+    """Restarts all units with one call and waits until each is active again.
+
+    Returns the time to active in ms per unit, None for units which failed or did not become
+    active within timeout_ms.
+    """
+    names = list(dict.fromkeys(names))
+    if len(names) == 0:
+        return {}
+    _systemd_reload_batch.flush(is_user_unit)
+    # a restarted unit is back once it entered the active state again
+    entered = { n: s.get("ActiveEnterTimestampMonotonic", "") for n, s in query_systemd_states(is_user_unit, names).items() }
+    timestamp = get_millis()
+    if systemd_dbus_call(is_user_unit, lambda m: m.enqueue_restart_units(names), is_action=True) is None:
+        systemctl = "systemctl --user" if is_user_unit else "sudo systemctl"
+        run_bash_cmd(f"{systemctl} restart --no-block {' '.join(names)}")
+
+    result: dict[str, Optional[int]] = {}
+    pending = list(names)
+    while len(pending) > 0 and millis_passed(timestamp) < timeout_ms:
+        _systemd_state_cache.invalidate(is_user_unit)
+        states = query_systemd_states(is_user_unit, pending)
+        for name in list(pending):
+            state = states.get(name, {})
+            if state.get("ActiveState") == "active" and state.get("ActiveEnterTimestampMonotonic", "") != entered.get(name, ""):
+                result[name] = millis_passed(timestamp)
+                pending.remove(name)
+            elif state.get("ActiveState") == "failed":
+                result[name] = None
+                pending.remove(name)
+        if len(pending) > 0:
+            sleep(SYSTEMD_RESTART_POLL_INTERVAL_S)
+    for name in pending:
+        result[name] = None
+    _systemd_state_cache.invalidate(is_user_unit)
+    return result
+
+
+def restart_servicers(servicers) -> list[Optional[int]]:
+    """Restarts servicers with one batched call per systemd manager, returns time to active in servicers order."""
+    results: dict[bool, dict[str, Optional[int]]] = {}
+    for is_user_unit in (True, False):
+        names = [s._name for s in servicers if s._is_user_unit == is_user_unit]
+        results[is_user_unit] = restart_systemd_units(is_user_unit, names)
+    return [results[s._is_user_unit].get(s._name) for s in servicers]
 
 
 class _ServicerBase:
@@ -43,11 +238,28 @@ class _ServicerBase:
                 return "systemctl"
 
     def _systemd_deamon_reload(self):
-        cmd = f"{self._systemd_cmd(is_action=True)} daemon-reload"
-        run_bash_cmd(cmd)
+        if not _systemd_reload_batch.defer(self._is_user_unit):
+            _systemd_daemon_reload_now(self._is_user_unit)
 
     def _call_systemd_action(self, action):
-        run_bash_cmd(f"{self._systemd_cmd(is_action=True)} {action} {self._name}")
+        dbus_actions = {
+            "start": lambda m: m.start_unit(self._name),
+            "stop": lambda m: m.stop_unit(self._name),
+            "restart": lambda m: m.restart_unit(self._name),
+            "enable": lambda m: m.enable_unit(self._name),
+            "disable": lambda m: m.disable_unit(self._name),
+        }
+        _systemd_reload_batch.flush(self._is_user_unit)
+        dbus_action = dbus_actions.get(action)
+        if dbus_action is None or systemd_dbus_call(self._is_user_unit, dbus_action, is_action=True) is None:
+            run_bash_cmd(f"{self._systemd_cmd(is_action=True)} {action} {self._name}")
+        _systemd_state_cache.invalidate(self._is_user_unit, self._name)
+
+    def _get_systemd_state(self, key) -> str:
+        state = _systemd_state_cache.get(self._is_user_unit, self._name)
+        if state is None:
+            state = query_systemd_states(self._is_user_unit, [self._name]).get(self._name, {})
+        return state.get(key, "")
 
     def enable(self):
         self._call_systemd_action("enable")
@@ -56,8 +268,7 @@ class _ServicerBase:
         self._call_systemd_action("disable")
 
     def is_enabled(self):
-        cmd = f"{self._systemd_cmd(is_action=False)} is-enabled --quiet {self._name}"
-        return run_bash_cmd(cmd, return_lines=False, return_code=True) == 0
+        return self._get_systemd_state("UnitFileState") in SYSTEMD_ENABLED_UNIT_FILE_STATES
 
     def start(self):
         self._call_systemd_action("start")
@@ -69,8 +280,7 @@ class _ServicerBase:
         self._call_systemd_action("restart")
 
     def is_started(self):
-        cmd = f"{self._systemd_cmd(is_action=False)} is-active --quiet {self._name}"
-        return run_bash_cmd(cmd, return_lines=False, return_code=True) == 0
+        return self._get_systemd_state("ActiveState") in ["active", "reloading"]
 
     def logs(self, follow=True, since=None):
         cmd = self._journalctl_cmd
@@ -88,27 +298,19 @@ class _ServicerBase:
         os.system(cmd)
 
     def is_installed(self):
-        verb = "list-units" if self._is_dynamic else "list-unit-files"
-        cmd = f"{self._systemd_cmd(is_action=False)} {verb} --type service --no-pager | grep -Fq \"{self._name}\""
-        return run_bash_cmd(cmd, return_lines=False, return_code=True) == 0
+        if self._is_dynamic:
+            # dynamic units are only listed while loaded: active, failed or transitioning
+            return self._get_systemd_state("ActiveState") not in ["", "inactive"]
+        return self._get_systemd_state("LoadState") not in ["", "not-found"]
 
     def is_systemd_file_modified(self):
-        # TODO: implement
         return False
 
     def get_active_state(self):
-        cmd = f"{self._systemd_cmd(is_action=False)} show -p ActiveState --value {self._name}"
-        lines = run_bash_cmd(cmd, remove_empty_lines=True)
-        if lines is None or not isinstance(lines, list):
-            lines = [""]
-        return ANSI_ESCAPE.sub('', lines[0].strip())
+        return self._get_systemd_state("ActiveState")
 
     def get_sub_state(self):
-        cmd = f"{self._systemd_cmd(is_action=False)} show -p SubState --value {self._name}"
-        lines = run_bash_cmd(cmd, remove_empty_lines=True)
-        if lines is None or not isinstance(lines, list):
-            lines = [""]
-        return ANSI_ESCAPE.sub('', lines[0].strip())
+        return self._get_systemd_state("SubState")
 
     def get_status(self):
         message = ""
@@ -121,8 +323,8 @@ class _ServicerBase:
                 message += f" {TCOL.OKBLUE}M{TCOL.END}"
         return message
 
-    def install(self):
-        pass
+    def install(self) -> bool:
+        return False
 
     def uninstall(self):
         pass
@@ -136,9 +338,13 @@ class Servicer(_ServicerBase):
         self._type = [type]
         self._environment = environment
         self._exec_start_pre = exec_start_pre
-        self.logger = log_factory.get(name="svs_servicer", tag="SERVICER")
+        self._watchdog_sec = []
         self._unit_path = SYSTEMD_CONFIG_USER_PATH if self._is_user_unit else SYSTEMD_CONFIG_SYSTEM_PATH
 
+    @property
+    def logger(self):
+        return log_factory.get(name="svs_servicer", tag="SERVICER")
+
     @staticmethod
     def _add_field_values_to_file_lines(field, values, file_lines):
         index = next(iter([i for i, s in enumerate(file_lines) if field in s]), None)
@@ -154,16 +360,40 @@ class Servicer(_ServicerBase):
         self._add_field_values_to_file_lines("Type=", self._type, file_lines)
         self._add_field_values_to_file_lines("Environment=", self._environment, file_lines)
         self._add_field_values_to_file_lines("ExecStartPre=", self._exec_start_pre, file_lines)
+        self._add_field_values_to_file_lines("WatchdogSec=", self._watchdog_sec, file_lines)
         return file_lines
 
+    def _get_unit_file_path(self):
+        return f"{self._unit_path}/{self._name}"
+
+    def _read_unit_file(self) -> Optional[str]:
+        try:
+            with open(get_full_path(self._get_unit_file_path()), "r") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _get_systemd_service_content(self) -> str:
+        # same layout write_lines_to_file produces
+        return "\n".join(self._generate_systemd_service()) + "\n"
+
+    def is_systemd_file_modified(self):
+        """True when the unit file on disk differs from what install would write."""
+        content = self._read_unit_file()
+        return content is not None and content != self._get_systemd_service_content()
+
     def _copy_service_file(self):
         if not check_if_path_exists(self._unit_path):
             create_path(self._unit_path)
-        write_lines_to_file(self._generate_systemd_service(), f"{self._unit_path}/{self._name}", sudo_required=(not self._is_user_unit))
+        write_lines_to_file(self._generate_systemd_service(), self._get_unit_file_path(), sudo_required=(not self._is_user_unit))
 
-    def install(self):
+    def install(self) -> bool:
+        """Writes the unit file and reloads systemd only when the content changed, returns True if it did."""
+        if self._read_unit_file() == self._get_systemd_service_content():
+            return False
         self._copy_service_file()
         self._systemd_deamon_reload()
+        return True
 
     def uninstall(self):
         remove_file(f"{self._unit_path}/{self._name}", sudo_required=(not self._is_user_unit))
@@ -178,8 +408,21 @@ class DynamicServicer(_ServicerBase):
 
 
 class PythonServicer(Servicer):
-    def __init__(self, name, exec_start, description):
-        super().__init__(name=name, exec_start=exec_start, description=description, type="notify", environment=["PYTHONUNBUFFERED=true"])
+    """Service run through loytra-service-runner.
+
+    watchdog_sec enables the systemd watchdog. The runner only keeps it alive while the service starts up,
+    from READY on the service must call notify_watchdog at least every watchdog_sec or systemd restarts it.
+    With explicit_ready the service is only considered started once it calls notify_ready, otherwise the
+    runner reports ready after importing the module (before the import when no function is given).
+    """
+
+    def __init__(self, name, exec_start, description, watchdog_sec: Optional[int] = None, explicit_ready=False):
+        environment = ["PYTHONUNBUFFERED=true"]
+        if explicit_ready:
+            environment.append(f"{EXPLICIT_READY_ENV}=1")
+        super().__init__(name=name, exec_start=exec_start, description=description, type="notify", environment=environment)
+        if watchdog_sec is not None:
+            self._watchdog_sec = [str(watchdog_sec)]
 
 
 if __name__ == "__main__":
@@ -1,10 +1,20 @@
+import os
 import os.path
+import pickle
+import sys
+import sysconfig
+from typing import Any, Optional
 from loytra_modules._module_spec import LoytraModule, LoytraModuleInstance, LoytraModuleReference
 from loytra_modules._util import get_loytra_parent_path
-from loytra_common.utils import get_file_list_in_path, check_if_path_exists
+from loytra_common.utils import get_file_list_in_path, check_if_path_exists, parallel_map
 
 LOYTRA_MODULE_FILE = "__loytra_module__.py"
 
+_MODULE_INDEX_VERSION = 2
+_MODULE_INDEX_FILE_PATH = "~/.local/share/loytra/module_index.pickle"
+_MODULE_INDEX_FULL_PATH = os.path.abspath(os.path.expanduser(_MODULE_INDEX_FILE_PATH))
+_MODULE_INDEX_DISABLE_ENV = "LOYTRA_NO_MODULE_INDEX"
+
 
 def _get_loytra_module_folder_path(folder_name):
     return f"{get_loytra_parent_path()}/{folder_name}"
@@ -72,19 +82,156 @@ def _parse_loytra_module_export(loytra_module_export) -> list[LoytraModule]:
     return result
 
 
+def _get_loytra_sources_fingerprint() -> list[tuple[str, int, int]]:
+    # pickled specs reference loytra classes, so any change to them invalidates the index
+    sources_path = os.path.dirname(os.path.abspath(__file__))
+    fingerprint = []
+    for dir_path, dir_names, file_names in os.walk(sources_path):
+        dir_names[:] = sorted(d for d in dir_names if d != "__pycache__")
+        for file_name in sorted(file_names):
+            if file_name.endswith(".py"):
+                file_path = os.path.join(dir_path, file_name)
+                st = os.stat(file_path)
+                fingerprint.append((os.path.relpath(file_path, sources_path), st.st_mtime_ns, st.st_size))
+    return fingerprint
+
+
+def _get_file_key(file_path) -> tuple[int, int]:
+    st = os.stat(file_path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _get_imported_files() -> set[str]:
+    """Source files of the imported modules, without the standard library and loytra_modules itself."""
+    skip_paths = tuple(os.path.join(os.path.realpath(p), "") for p in {
+        sysconfig.get_paths()["stdlib"],
+        sysconfig.get_paths()["platstdlib"],
+        os.path.dirname(os.path.abspath(__file__)),
+    })
+    result = set()
+    for module in list(sys.modules.values()):
+        file_path = getattr(module, "__file__", None)
+        if not isinstance(file_path, str) or not file_path.endswith(".py"):
+            continue
+        file_path = os.path.realpath(file_path)
+        if not file_path.startswith(skip_paths):
+            result.add(file_path)
+    return result
+
+
+def _get_dependency_keys(file_paths) -> Optional[dict[str, tuple[int, int]]]:
+    try:
+        return { file_path: _get_file_key(file_path) for file_path in sorted(file_paths) }
+    except OSError:
+        return None
+
+
+def _read_module_index() -> dict[str, Any]:
+    if not os.path.exists(_MODULE_INDEX_FULL_PATH):
+        return {}
+    try:
+        with open(_MODULE_INDEX_FULL_PATH, "rb") as f:
+            index = pickle.load(f)
+        if isinstance(index, dict) \
+                and index.get("version") == _MODULE_INDEX_VERSION \
+                and index.get("sources") == _get_loytra_sources_fingerprint():
+            return index.get("entries", {})
+    except:
+        pass
+    return {}
+
+
+def _write_module_index(entries: dict[str, Any]) -> bool:
+    index = {
+        "version": _MODULE_INDEX_VERSION,
+        "sources": _get_loytra_sources_fingerprint(),
+        "entries": entries,
+    }
+    tmp_path = f"{_MODULE_INDEX_FULL_PATH}.{os.getpid()}.tmp"
+    try:
+        # the index is only a cache, an unwritable home must not break discovery
+        os.makedirs(os.path.dirname(_MODULE_INDEX_FULL_PATH), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            pickle.dump(index, f)
+        os.replace(tmp_path, _MODULE_INDEX_FULL_PATH)
+        return True
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def _load_indexed_modules(entry, file_key) -> Optional[list[LoytraModule]]:
+    if entry is None or entry.get("key") != file_key:
+        return None
+    # specs may build their modules from code they import (e.g. a config module of the same repo)
+    dependencies = entry.get("dependencies", {})
+    if _get_dependency_keys(dependencies.keys()) != dependencies:
+        return None
+    try:
+        return pickle.loads(entry["modules"])
+    except:
+        return None
+
+
+def _load_modules_from_folder(folder_name) -> Optional[list[LoytraModule]]:
+    file_path = _get_loytra_module_file_path(folder_name)
+    try:
+        module_export = _get_loytra_module_from_file_path(folder_name, file_path)
+        if module_export is None:
+            print(f"Failed to load module from {folder_name}")
+            return None
+        return _parse_loytra_module_export(module_export)
+    except Exception as e:
+        print(f"Error importing loytra module {folder_name} with {e}")
+    return None
+
+
 def _get_loytra_modules() -> list[LoytraModule]:
-    loytra_modules: list[LoytraModule] = []
-    for folder_name in _get_folder_names_in_loytra_parent_path():
+    use_index = os.environ.get(_MODULE_INDEX_DISABLE_ENV, "0") != "1"
+    index_entries = _read_module_index() if use_index else {}
+    new_entries: dict[str, Any] = {}
+
+    loaded: dict[str, list[LoytraModule]] = {}
+    changed: list[tuple[str, str, tuple[int, int]]] = []
+    folder_names = _get_folder_names_in_loytra_parent_path()
+    for folder_name in folder_names:
         file_path = _get_loytra_module_file_path(folder_name)
-        if check_if_path_exists(file_path):
+        if not check_if_path_exists(file_path):
+            continue
+        file_key = _get_file_key(file_path)
+        entry = index_entries.get(file_path)
+        modules = _load_indexed_modules(entry, file_key)
+        if modules is not None:
+            loaded[folder_name] = modules
+            new_entries[file_path] = entry
+        else:
+            changed.append((folder_name, file_path, file_key))
+
+    # only new or modified module files are executed
+    if len(changed) > 0:
+        imported_before = _get_imported_files()
+        results = parallel_map([folder_name for folder_name, _, _ in changed], _load_modules_from_folder)
+        # specs run concurrently and share sys.modules, so everything imported meanwhile is a dependency of each of them
+        dependencies = _get_dependency_keys(_get_imported_files() - imported_before)
+        for (folder_name, file_path, file_key), modules in zip(changed, results):
+            if modules is None:
+                continue
+            loaded[folder_name] = modules
+            if dependencies is None:
+                continue
             try:
-                module_export = _get_loytra_module_from_file_path(folder_name, file_path)
-                if module_export is None:
-                    print(f"Failed to load module from {folder_name}")
-                    continue
-                loytra_modules.extend(_parse_loytra_module_export(module_export))
-            except Exception as e:
-                print(f"Error importing loytra module {folder_name} with {e}")
+                new_entries[file_path] = { "key": file_key, "dependencies": dependencies, "modules": pickle.dumps(modules) }
+            except:
+                # specs holding unpicklable objects (lambdas, locally defined functions) are always executed
+                pass
+
+    if use_index and (len(changed) > 0 or new_entries.keys() != index_entries.keys()):
+        _write_module_index(new_entries)
+
+    loytra_modules: list[LoytraModule] = []
+    for folder_name in folder_names:
+        loytra_modules.extend(loaded.get(folder_name, []))
 
     result: list[LoytraModule] = []
 
@@ -0,0 +1,66 @@
+import os
+import site
+import threading
+from typing import Optional
+
+
+class InstalledModuleRegistry:
+    """Process wide memo of importable modules.
+
+    sys.path is only rebuilt (reload of site, which rescans all .pth files) when a site-packages
+    directory changes mtime, i.e. when a distribution or an editable install was added or removed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key: Optional[tuple] = None
+        self._installed: dict[str, bool] = {}
+
+    @staticmethod
+    def _get_site_dirs() -> list[str]:
+        site_dirs = list(site.getsitepackages()) if hasattr(site, "getsitepackages") else []
+        if site.ENABLE_USER_SITE is not False:
+            site_dirs.append(site.getusersitepackages())
+        return site_dirs
+
+    def get_key(self) -> tuple:
+        key = []
+        for site_dir in self._get_site_dirs():
+            try:
+                key.append(os.stat(site_dir).st_mtime_ns)
+            except OSError:
+                key.append(None)
+        return tuple(key)
+
+    def _refresh(self, key):
+        # the interpreter already did this at startup, so the first lookup only records the key
+        if self._key is not None:
+            from importlib import invalidate_caches, reload
+            reload(site)
+            invalidate_caches()
+        self._key = key
+        self._installed = {}
+
+    def invalidate(self):
+        """Forces a sys.path rebuild on the next lookup, e.g. after pip (un)installed something."""
+        with self._lock:
+            if self._key is not None:
+                self._key = ()
+
+    def is_installed(self, module) -> bool:
+        key = self.get_key()
+        with self._lock:
+            if key != self._key:
+                self._refresh(key)
+            installed = self._installed.get(module)
+            if installed is None:
+                from importlib import util as imput
+                try:
+                    installed = imput.find_spec(module) is not None
+                except (ImportError, ValueError):
+                    installed = False
+                self._installed[module] = installed
+            return installed
+
+
+installed_module_registry = InstalledModuleRegistry()
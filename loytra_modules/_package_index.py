@@ -0,0 +1,108 @@
+import os
+import threading
+from typing import Optional
+from loytra_common.utils import run_bash_cmd
+
+PACMAN_LOCAL_DB_PATH = "/var/lib/pacman/local"
+DPKG_STATUS_PATH = "/var/lib/dpkg/status"
+APK_INSTALLED_DB_PATH = "/lib/apk/db/installed"
+
+
+class _InstalledPackageIndex:
+    """Process wide set of installed package names, rebuilt when its source path changes mtime."""
+
+    def __init__(self, source_path):
+        self._source_path = source_path
+        self._lock = threading.Lock()
+        self._key: Optional[int] = None
+        self._packages: set[str] = set()
+
+    def get_key(self) -> Optional[int]:
+        try:
+            return os.stat(self._source_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self) -> set[str]:
+        return set()
+
+    def get_packages(self) -> set[str]:
+        key = self.get_key()
+        with self._lock:
+            if key is None or key != self._key:
+                self._packages = self._load()
+                self._key = key
+            return self._packages
+
+    def is_installed(self, name) -> bool:
+        return name in self.get_packages()
+
+
+class PacmanPackageIndex(_InstalledPackageIndex):
+    def __init__(self):
+        super().__init__(PACMAN_LOCAL_DB_PATH)
+
+    def _load(self) -> set[str]:
+        try:
+            # local db entries are named '<name>-<pkgver>-<pkgrel>'
+            return { entry.rsplit("-", 2)[0] for entry in os.listdir(self._source_path) if entry.count("-") >= 2 }
+        except OSError:
+            lines = run_bash_cmd("/usr/bin/pacman --color never -Qq")
+            if lines is None or not isinstance(lines, list):
+                return set()
+            return { line.strip() for line in lines if len(line.strip()) > 0 }
+
+
+class DpkgPackageIndex(_InstalledPackageIndex):
+    def __init__(self):
+        super().__init__(DPKG_STATUS_PATH)
+
+    @staticmethod
+    def _add_package(packages, name, arch, status):
+        if name and status.endswith(" ok installed"):
+            packages.add(name)
+            if arch:
+                packages.add(f"{name}:{arch}")
+
+    def _load(self) -> set[str]:
+        packages: set[str] = set()
+        try:
+            name, arch, status = "", "", ""
+            with open(self._source_path, "r", errors="replace") as f:
+                for line in f:
+                    if line.startswith("Package:"):
+                        self._add_package(packages, name, arch, status)
+                        name, arch, status = line[8:].strip(), "", ""
+                    elif line.startswith("Architecture:"):
+                        arch = line[13:].strip()
+                    elif line.startswith("Status:"):
+                        status = line[7:].strip()
+            self._add_package(packages, name, arch, status)
+        except OSError:
+            lines = run_bash_cmd("dpkg-query -W -f='${Package} ${Architecture} ${Status}\\n'")
+            if lines is not None and isinstance(lines, list):
+                for line in lines:
+                    parts = line.split(" ", 2)
+                    if len(parts) == 3:
+                        self._add_package(packages, parts[0], parts[1], parts[2])
+        return packages
+
+
+class ApkPackageIndex(_InstalledPackageIndex):
+    def __init__(self):
+        super().__init__(APK_INSTALLED_DB_PATH)
+
+    def _load(self) -> set[str]:
+        try:
+            with open(self._source_path, "r", errors="replace") as f:
+                return { line[2:].strip() for line in f if line.startswith("P:") }
+        except OSError:
+            lines = run_bash_cmd("apk info")
+            if lines is None or not isinstance(lines, list):
+                return set()
+            return { line.strip() for line in lines if len(line.strip()) > 0 }
+
+
+pacman_package_index = PacmanPackageIndex()
+dpkg_package_index = DpkgPackageIndex()
+apk_package_index = ApkPackageIndex()
@@ -0,0 +1,64 @@
+from loytra_common import log_factory
+from loytra_modules._loytra_packager import Packager, PackagerGroup, PackagerRepo, _get_packager_lock
+
+
+class PackagerTransaction:
+    """Syncs packagers with one install command per package backend.
+
+    All unsynced leaf packagers under the given packagers (walking PackagerGroup children without
+    declared dependencies and resolving PackagerRepo to its backend) are collected. Batchable ones are grouped by backend
+    type and installed through that type's sync_many, everything else is synced on its own.
+    Batched packagers read their result back with is_sync afterwards (sync_many only reports the
+    whole command), the rest report what their own sync returned.
+    """
+
+    def __init__(self, packagers: list[Packager]):
+        self.packagers = packagers
+        self.logger = log_factory.get(name="svs_packager_transaction", tag="PACKAGER:TRANSACTION")
+
+    @staticmethod
+    def _iter_leaves(packagers: list[Packager]):
+        for packager in packagers:
+            # groups with declared dependencies keep their order and sync through their own executor
+            if isinstance(packager, PackagerGroup) and len(packager.dependencies) == 0:
+                yield from PackagerTransaction._iter_leaves(packager.children)
+            else:
+                yield packager
+
+    @staticmethod
+    def _get_backend(packager: Packager) -> Packager:
+        if isinstance(packager, PackagerRepo):
+            return packager.package_manager
+        return packager
+
+    def plan(self) -> tuple[dict[type, list[tuple[Packager, Packager]]], list[Packager]]:
+        """Returns unsynced (packager, backend) pairs grouped by backend type, and the unbatchable rest."""
+        batches: dict[type, list[tuple[Packager, Packager]]] = {}
+        rest: list[Packager] = []
+        seen: set[int] = set()
+        for packager in self._iter_leaves(self.packagers):
+            if id(packager) in seen:
+                continue
+            seen.add(id(packager))
+            if packager.is_sync():
+                continue
+            backend = self._get_backend(packager)
+            if backend.is_batchable():
+                batches.setdefault(type(backend), []).append((packager, backend))
+            else:
+                rest.append(packager)
+        return batches, rest
+
+    def run(self) -> list[tuple[Packager, bool]]:
+        batches, rest = self.plan()
+        results: list[tuple[Packager, bool]] = []
+        for backend_type, members in batches.items():
+            self.logger.info(f"{backend_type.__name__}: {', '.join(p.name for p, _ in members)}")
+            with _get_packager_lock(members[0][1].get_lock_key()):
+                backend_type.sync_many([backend for _, backend in members])
+            for packager, backend in members:
+                backend.invalidate_sync_state()
+                results.append((packager, packager.is_sync()))
+        for packager in rest:
+            results.append((packager, bool(packager.sync())))
+        return results
@@ -0,0 +1,121 @@
+from typing import Optional
+import glob
+import hashlib
+import json
+import os
+import os.path
+import re
+import threading
+from pathlib import Path
+
+_FINGERPRINTS_FILE_PATH = "~/.local/share/loytra/pip_fingerprints.json"
+_FINGERPRINTS_FULL_PATH = os.path.abspath(os.path.expanduser(_FINGERPRINTS_FILE_PATH))
+
+PIP_PACKAGING_FILES = ["setup.py", "setup.cfg", "pyproject.toml", "requirements*.txt"]
+
+_REQUIREMENT_NAME_RE = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+_lock = threading.Lock()
+
+
+def _read() -> dict[str, str]:
+    if not os.path.exists(_FINGERPRINTS_FULL_PATH):
+        return {}
+    try:
+        with open(_FINGERPRINTS_FULL_PATH, "r") as f:
+            data = json.loads(f.read())
+        if data is not None and isinstance(data, dict):
+            return data
+    except:
+        pass
+    return {}
+
+
+def _write(data: dict[str, str]) -> bool:
+    dir_path = os.path.dirname(_FINGERPRINTS_FULL_PATH)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    try:
+        tmp_path = f"{_FINGERPRINTS_FULL_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w+") as f:
+            f.write(json.dumps(data, indent=2))
+        os.replace(tmp_path, _FINGERPRINTS_FULL_PATH)
+        return True
+    except:
+        return False
+
+
+def _get_distribution_name(install_location, package, module) -> str:
+    """Name of the installed distribution, Moduler.package is the repo name and may differ from it."""
+    from importlib import metadata
+    if module is not None:
+        distributions = metadata.packages_distributions().get(module.split(".")[0], [])
+        if len(distributions) > 0:
+            return distributions[0]
+    # editable installs record their source directory (PEP 610)
+    install_url = Path(os.path.abspath(install_location)).as_uri()
+    for distribution in metadata.distributions():
+        try:
+            direct_url = json.loads(distribution.read_text("direct_url.json") or "{}")
+        except ValueError:
+            continue
+        if direct_url.get("url", "").rstrip("/") == install_url:
+            return distribution.metadata["Name"]
+    return package
+
+
+def _get_resolved_dependencies(distribution_name) -> list[str]:
+    # installed versions of the declared requirements, a changed or removed dependency changes the fingerprint
+    from importlib import metadata
+    try:
+        requirements = metadata.requires(distribution_name) or []
+    except metadata.PackageNotFoundError:
+        return ["<not installed>"]
+    resolved = set()
+    for requirement in requirements:
+        if "extra ==" in requirement:
+            continue
+        match = _REQUIREMENT_NAME_RE.match(requirement)
+        if match is None:
+            continue
+        name = match.group(1)
+        try:
+            resolved.add(f"{name}=={metadata.version(name)}")
+        except metadata.PackageNotFoundError:
+            resolved.add(f"{name}==<missing>")
+    return sorted(resolved)
+
+
+def get_pip_fingerprint(install_location, package, module=None) -> str:
+    """Hash of the packaging files in install_location and the resolved dependencies of its distribution.
+
+    The distribution is looked up through the importable module, then the editable install location,
+    package is the last resort.
+    """
+    digest = hashlib.sha256()
+    for pattern in PIP_PACKAGING_FILES:
+        for path in sorted(glob.glob(os.path.join(install_location, pattern))):
+            digest.update(os.path.basename(path).encode())
+            try:
+                with open(path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            except OSError:
+                pass
+    if package is not None or module is not None:
+        for dependency in _get_resolved_dependencies(_get_distribution_name(install_location, package, module)):
+            digest.update(dependency.encode())
+    return digest.hexdigest()
+
+
+def read_pip_fingerprint(install_location) -> Optional[str]:
+    with _lock:
+        return _read().get(install_location)
+
+
+def write_pip_fingerprint(install_location, fingerprint: Optional[str]) -> bool:
+    with _lock:
+        data = _read()
+        if fingerprint is None:
+            data.pop(install_location, None)
+        else:
+            data[install_location] = fingerprint
+        return _write(data)
@@ -0,0 +1,73 @@
+import os
+import threading
+from typing import Optional
+
+EXPLICIT_READY_ENV = "LOYTRA_EXPLICIT_READY"
+
+_notifier = None
+_notifier_lock = threading.Lock()
+_auto_watchdog_stop = threading.Event()
+
+
+def _notify(state) -> bool:
+    # outside of systemd (e.g. 'loytra run') there is no socket and notifications are dropped
+    global _notifier
+    if os.environ.get("NOTIFY_SOCKET") is None:
+        return False
+    with _notifier_lock:
+        if _notifier is None:
+            import sdnotify
+            _notifier = sdnotify.SystemdNotifier()
+        _notifier.notify(state)
+    return True
+
+
+def is_explicit_ready() -> bool:
+    """True when the service declared it calls notify_ready itself (see PythonServicer explicit_ready)."""
+    return os.environ.get(EXPLICIT_READY_ENV, "0") == "1"
+
+
+def notify_ready(status: Optional[str] = None) -> bool:
+    """Tells systemd the service is up and able to take load, ends the runner's automatic keepalives."""
+    _auto_watchdog_stop.set()
+    return _notify("READY=1" if status is None else f"READY=1\nSTATUS={status}")
+
+
+def notify_status(status: str) -> bool:
+    return _notify(f"STATUS={status}")
+
+
+def notify_watchdog() -> bool:
+    """Watchdog keepalive, a service with WatchdogSec sends it itself once it is ready."""
+    _auto_watchdog_stop.set()
+    return _notify("WATCHDOG=1")
+
+
+def get_watchdog_interval_s() -> Optional[float]:
+    """WatchdogSec of this service in seconds, None when the watchdog is off or meant for another process."""
+    watchdog_pid = os.environ.get("WATCHDOG_PID")
+    if watchdog_pid is not None and watchdog_pid != str(os.getpid()):
+        return None
+    try:
+        watchdog_usec = int(os.environ.get("WATCHDOG_USEC", "0"))
+    except ValueError:
+        return None
+    return watchdog_usec / 1000000 if watchdog_usec > 0 else None
+
+
+def _auto_watchdog_loop(interval_s):
+    while not _auto_watchdog_stop.wait(interval_s):
+        _notify("WATCHDOG=1")
+
+
+def start_auto_watchdog() -> Optional[threading.Thread]:
+    """Pings the watchdog at half its interval while the service starts, until READY or its own first keepalive.
+
+    Keeping it alive for longer would hide a hung service from systemd.
+    """
+    interval_s = get_watchdog_interval_s()
+    if interval_s is None:
+        return None
+    thread = threading.Thread(target=_auto_watchdog_loop, args=(interval_s / 2,), name="loytra_watchdog", daemon=True)
+    thread.start()
+    return thread
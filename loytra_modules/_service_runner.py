@@ -1,9 +1,19 @@
 def _call_module_function(module_name, function_name=""):
     from loytra_common import log_factory
+    from loytra_modules._service_notify import notify_ready, notify_status, is_explicit_ready
     log_factory.set_log_timestamp(False)
 
     import importlib
+    # services which declared explicit readiness call notify_ready once they are actually serving
+    auto_ready = not is_explicit_ready()
+    if auto_ready and len(function_name) == 0:
+        # without a function the import itself runs the service and may never return
+        notify_ready(status=f"running {module_name}")
+    else:
+        notify_status(f"importing {module_name}")
     module = importlib.import_module(module_name)
+    if auto_ready and len(function_name) > 0:
+        notify_ready(status=f"running {module_name}.{function_name}")
     if len(function_name) > 0:
         function = getattr(module, function_name)
         function()
@@ -11,10 +21,9 @@ def _call_module_function(module_name, function_name=""):
 
 def run_systemd_service():
     import sys
-    import sdnotify
+    from loytra_modules._service_notify import start_auto_watchdog
 
-    n = sdnotify.SystemdNotifier()
-    n.notify("READY=1")
+    start_auto_watchdog()
     if len(sys.argv) >= 3:
         _call_module_function(sys.argv[1], sys.argv[2])
     elif len(sys.argv) == 2:
@@ -28,4 +37,3 @@ def get_service_run_command(module: str, function: str = ""):
     if len(function) > 0:
         result = result + f" '{function}'"
     return result
-
@@ -0,0 +1,178 @@
+import os
+import threading
+from typing import Any, Callable, Optional
+from loytra_common import log_factory
+from loytra_common.options import options
+
+SYSTEMD_BUS_NAME = "org.freedesktop.systemd1"
+SYSTEMD_MANAGER_PATH = "/org/freedesktop/systemd1"
+SYSTEMD_MANAGER_INTERFACE = "org.freedesktop.systemd1.Manager"
+SYSTEMD_UNIT_INTERFACE = "org.freedesktop.systemd1.Unit"
+DBUS_PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+SYSTEMD_JOB_TIMEOUT_S = 90
+
+_logger = log_factory.get(name="svs_systemd_dbus", tag="SYSTEMD:DBUS")
+
+
+class SystemdJobError(Exception):
+    """A job was queued but its outcome is unknown, retrying through systemctl would run it twice."""
+
+
+def _open_jeepney_connection(is_user_unit):
+    # jeepney is an optional dependency, without it the subprocess backend is used
+    from jeepney.io.blocking import open_dbus_connection
+    return open_dbus_connection(bus="SESSION" if is_user_unit else "SYSTEM")
+
+
+class SystemdDBusManager:
+    """Talks to the systemd manager over an open (jeepney compatible) D-Bus connection."""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+        self._subscribed = False
+
+    def _call(self, path, interface, method, signature=None, body=()):
+        from jeepney import DBusAddress, new_method_call
+        from jeepney.wrappers import unwrap_msg
+        address = DBusAddress(path, bus_name=SYSTEMD_BUS_NAME, interface=interface)
+        reply = self._connection.send_and_get_reply(new_method_call(address, method, signature, body))
+        return unwrap_msg(reply)
+
+    def _call_manager(self, method, signature=None, body=()):
+        return self._call(SYSTEMD_MANAGER_PATH, SYSTEMD_MANAGER_INTERFACE, method, signature, body)
+
+    def get_unit_states(self, names, properties) -> dict[str, dict[str, str]]:
+        result: dict[str, dict[str, str]] = {}
+        with self._lock:
+            for name in names:
+                # LoadUnit returns a stub object for missing units, same as 'systemctl show'
+                unit_path = self._call_manager("LoadUnit", "s", (name,))[0]
+                values = self._call(unit_path, DBUS_PROPERTIES_INTERFACE, "GetAll", "s", (SYSTEMD_UNIT_INTERFACE,))[0]
+                result[name] = { p: str(values[p][1]) for p in properties if p in values }
+        return result
+
+    def _run_job(self, method, name) -> bool:
+        from jeepney import MatchRule, message_bus
+        rule = MatchRule(type="signal", sender=SYSTEMD_BUS_NAME, interface=SYSTEMD_MANAGER_INTERFACE,
+                         member="JobRemoved", path=SYSTEMD_MANAGER_PATH)
+        with self._lock:
+            if not self._subscribed:
+                self._connection.send_and_get_reply(message_bus.AddMatch(rule))
+                self._call_manager("Subscribe")
+                self._subscribed = True
+            # wait for the job to finish like 'systemctl start' does
+            with self._connection.filter(rule, bufsize=64) as queue:
+                job_path = self._call_manager(method, "ss", (name, "replace"))[0]
+                try:
+                    while True:
+                        signal = self._connection.recv_until_filtered(queue, timeout=SYSTEMD_JOB_TIMEOUT_S)
+                        _, removed_job_path, _, result = signal.body
+                        if removed_job_path == job_path:
+                            return result == "done"
+                except Exception as e:
+                    raise SystemdJobError(f"{method} {name}: {e}") from e
+
+    def start_unit(self, name) -> bool:
+        return self._run_job("StartUnit", name)
+
+    def stop_unit(self, name) -> bool:
+        return self._run_job("StopUnit", name)
+
+    def restart_unit(self, name) -> bool:
+        return self._run_job("RestartUnit", name)
+
+    def enqueue_restart_units(self, names) -> bool:
+        """Queues restart jobs without waiting for them, progress is followed through unit states."""
+        with self._lock:
+            for i, name in enumerate(names):
+                try:
+                    self._call_manager("RestartUnit", "ss", (name, "replace"))
+                except Exception as e:
+                    if i == 0:
+                        raise
+                    raise SystemdJobError(f"RestartUnit {name}: {e}") from e
+        return True
+
+    def enable_unit(self, name) -> bool:
+        with self._lock:
+            self._call_manager("EnableUnitFiles", "asbb", ([name], False, False))
+            self._call_manager("Reload")
+        return True
+
+    def disable_unit(self, name) -> bool:
+        with self._lock:
+            self._call_manager("DisableUnitFiles", "asb", ([name], False))
+            self._call_manager("Reload")
+        return True
+
+    def reload(self) -> bool:
+        with self._lock:
+            self._call_manager("Reload")
+        return True
+
+
+_connection_factory: Callable[[bool], Any] = _open_jeepney_connection
+_managers: dict[bool, Optional[SystemdDBusManager]] = {}
+_managers_lock = threading.Lock()
+
+
+def set_systemd_dbus_connection_factory(factory: Callable[[bool], Any]):
+    """Replaces the bus connection factory, e.g. with a local stand-in bus for testing."""
+    global _connection_factory
+    with _managers_lock:
+        _connection_factory = factory
+        _managers.clear()
+
+
+def _is_dbus_backend_enabled():
+    return options.systemd_backend in ["auto", "dbus"]
+
+
+def _fall_back(reason) -> None:
+    # LOYTRA_SYSTEMD_BACKEND=dbus asks for D-Bus only, falling back would hide a broken setup
+    if options.systemd_backend == "dbus":
+        raise RuntimeError(f"systemd D-Bus backend required but {reason}")
+    if options.verbose:
+        _logger.debug(f"{reason}, using systemctl")
+    return None
+
+
+def get_systemd_dbus_manager(is_user_unit) -> Optional[SystemdDBusManager]:
+    if not _is_dbus_backend_enabled():
+        return None
+    with _managers_lock:
+        if is_user_unit not in _managers:
+            try:
+                _managers[is_user_unit] = SystemdDBusManager(_connection_factory(is_user_unit))
+            except Exception as e:
+                _fall_back(f"D-Bus unavailable: {e}")
+                _managers[is_user_unit] = None
+        return _managers[is_user_unit]
+
+
+def can_call_systemd_dbus_action(is_user_unit):
+    # system manager actions need root, otherwise they go through 'sudo systemctl'
+    return is_user_unit or os.geteuid() == 0
+
+
+def systemd_dbus_call(is_user_unit, call: Callable[[SystemdDBusManager], Any], is_action=False) -> Optional[Any]:
+    """Runs call against the manager, returns None when the caller should fall back to systemctl.
+
+    Only failures before anything was queued fall back, a queued job which failed or timed out returns False.
+    With the "dbus" backend option a fallback raises RuntimeError instead.
+    """
+    if not _is_dbus_backend_enabled():
+        return None
+    if is_action and not can_call_systemd_dbus_action(is_user_unit):
+        return _fall_back("system unit actions need root")
+    manager = get_systemd_dbus_manager(is_user_unit)
+    if manager is None:
+        return None
+    try:
+        return call(manager)
+    except SystemdJobError as e:
+        _logger.error(f"systemd job failed: {e}")
+        return False
+    except Exception as e:
+        return _fall_back(f"D-Bus call failed: {e}")
@@ -34,5 +34,9 @@ setuptools.setup(
         # websockets
         'websockets'
     ],
+    extras_require={
+        # systemd D-Bus backend, falls back to systemctl when missing
+        'dbus': ['jeepney'],
+    },
 )
 
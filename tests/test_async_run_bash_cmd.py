@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from loytra_common import utils
+from loytra_common.options import options
+from loytra_common.utils import async_run_bash_cmd
+
+
+def _is_running(pid):
+    # killed children may linger as zombies until their new parent reaps them
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def _wait_for_pid(pid_file):
+    for _ in range(100):
+        if pid_file.exists() and pid_file.read_text().strip():
+            return int(pid_file.read_text())
+        time.sleep(0.01)
+    raise AssertionError("command did not start")
+
+
+def test_argv_list_and_interaction():
+    lines = asyncio.run(async_run_bash_cmd(["printf", "%s\\n", "a b", "$HOME"]))
+    assert lines == ["a b", "$HOME"]
+    lines = asyncio.run(async_run_bash_cmd("read -p 'Name: ' name; echo hi $name", interaction={"Name: ": "bob"}))
+    assert lines[-1] == "hi bob"
+
+
+def test_timeout_kills_process_group(tmp_path):
+    pid_file = tmp_path / "pid"
+    cmd = f"sleep 30 & echo $! > {pid_file}; wait"
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(async_run_bash_cmd(cmd, timeout=0.3))
+    pid = _wait_for_pid(pid_file)
+    time.sleep(0.1)
+    assert not _is_running(pid)
+
+
+def test_cancellation_kills_process_group(tmp_path):
+    pid_file = tmp_path / "pid"
+
+    async def run():
+        task = asyncio.create_task(async_run_bash_cmd(f"sleep 30 & echo $! > {pid_file}; wait"))
+        while not pid_file.exists() or not pid_file.read_text().strip():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    time.sleep(0.1)
+    assert not _is_running(_wait_for_pid(pid_file))
+
+
+def test_limiter(monkeypatch):
+    async def run(count, limiter=None):
+        start = time.monotonic()
+        await asyncio.gather(*[async_run_bash_cmd("sleep 0.2", limiter=limiter) for _ in range(count)])
+        return time.monotonic() - start
+
+    monkeypatch.setattr(options, "jobs", 2)
+    # two rounds of two with the default per loop limiter
+    assert 0.4 <= asyncio.run(run(4)) < 0.8
+
+    async def run_with_custom_limiter():
+        return await run(3, asyncio.Semaphore(1))
+
+    assert asyncio.run(run_with_custom_limiter()) >= 0.6
+
+
+def test_password_prompt_does_not_block_the_loop(monkeypatch):
+    def get_linux_password():
+        time.sleep(0.3)
+        return "secret"
+
+    monkeypatch.setattr(utils, "get_linux_password", get_linux_password)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.05)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        # 'sudo ' in the command is enough to ask for the password, the command itself does not use it
+        lines = await async_run_bash_cmd("echo 'no sudo needed'")
+        ticking.cancel()
+        return lines, ticks
+
+    lines, ticks = asyncio.run(run())
+    assert lines == ["no sudo needed"]
+    assert ticks >= 3
@@ -0,0 +1,135 @@
+import os
+import subprocess
+
+import pytest
+
+pytest.importorskip("git")
+
+from loytra_common.options import options
+from loytra_modules import _loytra_moduler
+from loytra_modules._loytra_moduler import Moduler, fetch_modulers, FETCH_MODE_FULL, FETCH_MODE_SHALLOW, FETCH_MODE_NEGOTIATE, CLONE_STRATEGY_SHALLOW
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME="loytra", GIT_AUTHOR_EMAIL="loytra@localhost",
+               GIT_COMMITTER_NAME="loytra", GIT_COMMITTER_EMAIL="loytra@localhost")
+
+
+def _git(*args, cwd=None):
+    subprocess.run(["git", *args], cwd=cwd, env=GIT_ENV, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _commit(work_path, name):
+    (work_path / name).write_text(name)
+    _git("add", name, cwd=work_path)
+    _git("commit", "-m", name, cwd=work_path)
+    _git("push", "origin", "HEAD:main", cwd=work_path)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """Bare repository served over file:// plus a working copy which pushes to it."""
+    bare_path = tmp_path / "remote" / "pkg.git"
+    work_path = tmp_path / "work"
+    _git("init", "--bare", "-b", "main", str(bare_path))
+    _git("clone", bare_path.as_uri(), str(work_path))
+    _commit(work_path, "a")
+    _commit(work_path, "b")
+    return bare_path, work_path
+
+
+def _clone_moduler(tmp_path, remote, name, *clone_args):
+    bare_path, _ = remote
+    install_path = tmp_path / "parent" / name
+    _git("clone", *clone_args, bare_path.as_uri(), str(install_path))
+    moduler = Moduler(package=name, url=bare_path.as_uri())
+    moduler.install_location = str(install_path)
+    return moduler
+
+
+def _behind(moduler):
+    return moduler._read_repo_status(moduler.install_location)["behind"]
+
+
+def test_fetch_modes(tmp_path, remote):
+    full = _clone_moduler(tmp_path, remote, "full")
+    negotiate = _clone_moduler(tmp_path, remote, "negotiate")
+    shallow = _clone_moduler(tmp_path, remote, "shallow", "--depth", "1")
+    _commit(remote[1], "c")
+
+    assert fetch_modulers([full, shallow], limit=2, mode=FETCH_MODE_FULL) == [True, True]
+    assert fetch_modulers([negotiate], mode=FETCH_MODE_NEGOTIATE) == [True]
+    assert _behind(full) == 1
+    assert _behind(shallow) == 1
+    # negotiation only checks the remote, refs stay as they were
+    assert _behind(negotiate) == 0
+
+
+def test_shallow_mode_keeps_full_clones_complete(tmp_path, remote):
+    full = _clone_moduler(tmp_path, remote, "full")
+    shallow = _clone_moduler(tmp_path, remote, "shallow", "--depth", "1")
+    _commit(remote[1], "c")
+
+    assert fetch_modulers([full, shallow], mode=FETCH_MODE_SHALLOW) == [True, True]
+    assert _behind(full) == 1
+    assert _behind(shallow) == 1
+    assert not os.path.exists(os.path.join(full.install_location, ".git", "shallow"))
+    assert os.path.exists(os.path.join(shallow.install_location, ".git", "shallow"))
+
+
+def test_default_mode_from_options(tmp_path, remote, monkeypatch):
+    moduler = _clone_moduler(tmp_path, remote, "pkg")
+    _commit(remote[1], "c")
+
+    monkeypatch.setattr(options, "fetch_mode", FETCH_MODE_NEGOTIATE)
+    assert fetch_modulers([moduler]) == [True]
+    assert _behind(moduler) == 0
+    monkeypatch.setattr(options, "fetch_mode", FETCH_MODE_FULL)
+    assert fetch_modulers([moduler]) == [True]
+    assert _behind(moduler) == 1
+
+
+def test_fetch_failures(tmp_path, remote):
+    moduler = _clone_moduler(tmp_path, remote, "pkg")
+    missing = Moduler(package="missing", url=remote[0].as_uri())
+    missing.install_location = str(tmp_path / "parent" / "missing")
+    os.rename(remote[0], tmp_path / "moved.git")
+
+    assert fetch_modulers([moduler, missing], mode=FETCH_MODE_FULL) == [False, None]
+
+
+def test_negotiate_detects_unreachable_remote(tmp_path, remote):
+    moduler = _clone_moduler(tmp_path, remote, "pkg")
+    assert fetch_modulers([moduler], mode=FETCH_MODE_NEGOTIATE) == [True]
+    os.rename(remote[0], tmp_path / "moved.git")
+    assert fetch_modulers([moduler], mode=FETCH_MODE_NEGOTIATE) == [False]
+
+
+def _head(path):
+    return subprocess.run(["git", "-C", str(path), "rev-parse", "HEAD"], stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.strip()
+
+
+@pytest.mark.parametrize("mode", [FETCH_MODE_SHALLOW, FETCH_MODE_FULL])
+def test_update_shallow_clone_after_fetch(tmp_path, remote, mode):
+    moduler = _clone_moduler(tmp_path, remote, "pkg", "--depth", "1")
+    for name in ["c", "d", "e"]:
+        _commit(remote[1], name)
+
+    # a shallow fetch leaves the new tip as its own shallow root, the update has to connect it
+    assert fetch_modulers([moduler], mode=FETCH_MODE_SHALLOW) == [True]
+    if mode == FETCH_MODE_FULL:
+        assert fetch_modulers([moduler], mode=mode) == [True]
+    assert moduler.update(fetched=True)
+    assert _head(moduler.install_location) == _head(remote[1])
+
+
+def test_shallow_clone_by_hash_when_fetch_by_hash_is_refused(tmp_path, remote, monkeypatch):
+    bare_path, work_path = remote
+    sha = _head(work_path)
+    for name in ["c", "d"]:
+        _commit(work_path, name)
+    # protocol v0 servers only hand out advertised refs, not arbitrary commits
+    monkeypatch.setenv("GIT_CONFIG_PARAMETERS", "'protocol.version=0'")
+    monkeypatch.setattr(_loytra_moduler, "get_loytra_parent_path", lambda: str(tmp_path / "parent"))
+    moduler = Moduler(package="pkg", url=bare_path.as_uri(), hash=sha, clone_strategy=CLONE_STRATEGY_SHALLOW)
+
+    assert moduler.download_module()
+    assert _head(moduler.install_location) == sha
@@ -0,0 +1,64 @@
+import threading
+import time
+
+from loytra_modules._loytra_packager import Packager, PackagerGroup, PackagerRepo, MultiPackager
+
+
+class _StubBackend(Packager):
+    """Package manager stand-in which records how many of its commands overlap."""
+
+    running = 0
+    max_running = 0
+    counter_lock = threading.Lock()
+
+    def get_lock_key(self):
+        return "repo"
+
+    def _is_sync(self):
+        return True
+
+    def _run(self):
+        cls = _StubBackend
+        with cls.counter_lock:
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        time.sleep(0.1)
+        with cls.counter_lock:
+            cls.running -= 1
+        return True
+
+    def _sync(self):
+        return self._run()
+
+    def _unsync(self):
+        return self._run()
+
+
+def _repo(name):
+    repo = PackagerRepo(name, name, name, name)
+    repo._package_manager = _StubBackend(name)
+    return repo
+
+
+def test_backend_lock_covers_nested_packagers():
+    _StubBackend.max_running = 0
+    group = PackagerGroup("group", [_repo("a"), MultiPackager("multi", [_repo("b")]), _repo("c")])
+    assert group.unsync()
+    assert _StubBackend.max_running == 1
+    group = PackagerGroup("group", [_repo("a"), PackagerGroup("nested", [_repo("b"), _repo("c")])])
+    assert group.sync()
+    assert _StubBackend.max_running == 1
+
+
+def test_steps_without_lock_key_run_concurrently():
+    running = []
+    overlapped = threading.Event()
+
+    class Unlocked(Packager):
+        def _sync(self):
+            running.append(self.name)
+            if len(running) == 2:
+                overlapped.set()
+            return overlapped.wait(1)
+
+    assert PackagerGroup("group", [Unlocked("a"), Unlocked("b")]).sync()
@@ -0,0 +1,53 @@
+import json
+
+from loytra_modules._pip_fingerprint import get_pip_fingerprint
+
+
+def _write_distribution(site_path, name, version, requires=(), top_level=None, direct_url=None):
+    dist_info = site_path / f"{name}-{version}.dist-info"
+    dist_info.mkdir()
+    lines = ["Metadata-Version: 2.1", f"Name: {name}", f"Version: {version}"]
+    lines += [f"Requires-Dist: {requirement}" for requirement in requires]
+    (dist_info / "METADATA").write_text("\n".join(lines) + "\n")
+    if top_level is not None:
+        (dist_info / "top_level.txt").write_text(top_level + "\n")
+    if direct_url is not None:
+        (dist_info / "direct_url.json").write_text(json.dumps({"url": direct_url, "dir_info": {"editable": True}}))
+    return dist_info
+
+
+def _set_dependency_version(site_path, version):
+    for dist_info in site_path.glob("fp_dependency-*.dist-info"):
+        for path in dist_info.iterdir():
+            path.unlink()
+        dist_info.rmdir()
+    _write_distribution(site_path, "fp_dependency", version)
+
+
+def test_dependencies_of_distribution_found_through_module(tmp_path, monkeypatch):
+    site_path = tmp_path / "site"
+    site_path.mkdir()
+    monkeypatch.syspath_prepend(str(site_path))
+    # the repo (Moduler.package) is named differently than the distribution it installs
+    _write_distribution(site_path, "fp_distribution", "1.0", requires=["fp_dependency>=1"], top_level="fp_module")
+    install_location = tmp_path / "fp_repo"
+    install_location.mkdir()
+
+    _set_dependency_version(site_path, "1.0")
+    before = get_pip_fingerprint(str(install_location), "fp_repo", "fp_module")
+    _set_dependency_version(site_path, "2.0")
+    assert get_pip_fingerprint(str(install_location), "fp_repo", "fp_module.sub") != before
+
+
+def test_dependencies_of_distribution_found_through_install_location(tmp_path, monkeypatch):
+    site_path = tmp_path / "site"
+    site_path.mkdir()
+    monkeypatch.syspath_prepend(str(site_path))
+    install_location = tmp_path / "fp_repo"
+    install_location.mkdir()
+    _write_distribution(site_path, "fp_distribution", "1.0", requires=["fp_dependency"], direct_url=install_location.as_uri())
+
+    _set_dependency_version(site_path, "1.0")
+    before = get_pip_fingerprint(str(install_location), "fp_repo", "fp_unknown_module")
+    _set_dependency_version(site_path, "2.0")
+    assert get_pip_fingerprint(str(install_location), "fp_repo", "fp_unknown_module") != before
@@ -0,0 +1,107 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("sdnotify")
+
+from loytra_modules._service_notify import EXPLICIT_READY_ENV
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICE_MODULE = """
+import time
+from loytra_modules import notify_ready, notify_status, notify_watchdog
+
+def main():
+    time.sleep(0.3)
+    notify_status("serving")
+    notify_ready()
+    for _ in range(3):
+        notify_watchdog()
+        time.sleep(0.1)
+"""
+
+BLOCKING_SERVICE_MODULE = """
+import time
+time.sleep(0.3)
+"""
+
+
+@pytest.fixture
+def notify_socket(tmp_path):
+    """Local stand-in for the systemd notify socket."""
+    path = str(tmp_path / "notify.sock")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.settimeout(0.05)
+    yield path, sock
+    sock.close()
+
+
+def _run_service(tmp_path, notify_socket, argv, env=None):
+    path, sock = notify_socket
+    (tmp_path / "svc_mod.py").write_text(SERVICE_MODULE)
+    (tmp_path / "svc_blocking.py").write_text(BLOCKING_SERVICE_MODULE)
+    run_env = dict(os.environ, NOTIFY_SOCKET=path, PYTHONPATH=os.pathsep.join([str(tmp_path), REPO_PATH, os.environ.get("PYTHONPATH", "")]))
+    run_env.pop("WATCHDOG_USEC", None)
+    run_env.pop(EXPLICIT_READY_ENV, None)
+    run_env.update(env or {})
+    code = f"import sys; sys.argv = {['loytra-service-runner'] + argv!r}; " \
+           "from loytra_modules._service_runner import run_systemd_service; run_systemd_service()"
+    p = subprocess.Popen([sys.executable, "-c", code], env=run_env)
+    messages = []
+    while True:
+        try:
+            messages.append(sock.recv(1024).decode())
+        except socket.timeout:
+            if p.poll() is not None:
+                break
+    assert p.returncode == 0
+    return messages
+
+
+def test_ready_after_import_with_function(tmp_path, notify_socket):
+    messages = _run_service(tmp_path, notify_socket, ["svc_mod", "main"])
+    assert messages[0] == "STATUS=importing svc_mod"
+    assert messages[1].startswith("READY=1")
+    assert "STATUS=serving" in messages
+
+
+def test_ready_before_import_without_function(tmp_path, notify_socket):
+    # the import runs the service, waiting for it to return would never report ready
+    messages = _run_service(tmp_path, notify_socket, ["svc_blocking"])
+    assert messages[0].startswith("READY=1")
+
+
+def test_explicit_ready(tmp_path, notify_socket):
+    messages = _run_service(tmp_path, notify_socket, ["svc_mod", "main"], env={EXPLICIT_READY_ENV: "1"})
+    assert messages[0] == "STATUS=importing svc_mod"
+    assert messages.index("STATUS=serving") < messages.index("READY=1")
+    assert sum(m.startswith("READY=1") for m in messages) == 1
+
+
+def test_auto_watchdog_stops_at_ready(tmp_path, notify_socket):
+    start = time.monotonic()
+    messages = _run_service(tmp_path, notify_socket, ["svc_mod", "main"],
+                            env={"WATCHDOG_USEC": "100000", EXPLICIT_READY_ENV: "1"})
+    assert time.monotonic() - start > 0.3
+    ready_index = messages.index("READY=1")
+    # automatic pings every 50 ms while importing and sleeping, afterwards only the service's own three
+    assert messages[:ready_index].count("WATCHDOG=1") >= 2
+    assert messages[ready_index + 1:].count("WATCHDOG=1") == 3
+
+
+def test_auto_watchdog_does_not_cover_a_hung_service(tmp_path, notify_socket):
+    # ready is sent before the import, the blocking module never pings and must be left to the watchdog
+    messages = _run_service(tmp_path, notify_socket, ["svc_blocking"], env={"WATCHDOG_USEC": "100000"})
+    assert messages[0].startswith("READY=1")
+    assert "WATCHDOG=1" not in messages
+
+
+def test_no_watchdog_without_watchdog_usec(tmp_path, notify_socket):
+    messages = _run_service(tmp_path, notify_socket, ["svc_blocking"])
+    assert "WATCHDOG=1" not in messages
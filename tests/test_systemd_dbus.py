@@ -0,0 +1,116 @@
+from collections import deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("jeepney")
+
+from jeepney import HeaderFields, new_method_return
+
+from loytra_common.options import options
+from loytra_modules import _loytra_servicer, _systemd_dbus
+from loytra_modules._loytra_servicer import Servicer
+from loytra_modules._systemd_dbus import SystemdDBusManager, set_systemd_dbus_connection_factory, systemd_dbus_call
+
+
+def _get_unit_path(name):
+    # systemd escapes unit names in object paths, e.g. a.service -> a_2eservice
+    return "/org/freedesktop/systemd1/unit/" + "".join(c if c.isalnum() else f"_{ord(c):02x}" for c in name)
+
+
+class FakeSystemdConnection:
+    """Stand-in for a jeepney blocking connection to the systemd manager."""
+
+    def __init__(self, units=None, job_results=None):
+        self.units = units or {}
+        # unit name -> JobRemoved result, units missing here never report their job (timeout)
+        self.job_results = job_results or {}
+        self.calls = []
+        self.signals = deque()
+        self._job_id = 0
+
+    def send_and_get_reply(self, msg):
+        member = msg.header.fields[HeaderFields.member]
+        self.calls.append((member, msg.body))
+        if member == "LoadUnit":
+            return new_method_return(msg, "o", (_get_unit_path(msg.body[0]),))
+        if member == "GetAll":
+            name = next(n for n in self.units if _get_unit_path(n) == msg.header.fields[HeaderFields.path])
+            return new_method_return(msg, "a{sv}", ({ k: ("s", v) for k, v in self.units[name].items() },))
+        if member in ["StartUnit", "StopUnit", "RestartUnit"]:
+            name = msg.body[0]
+            self._job_id += 1
+            job_path = f"/org/freedesktop/systemd1/job/{self._job_id}"
+            # another client's job finishes first and must not be taken for ours
+            self.signals.append(SimpleNamespace(body=(self._job_id + 1000, "/org/freedesktop/systemd1/job/other", name, "failed")))
+            if name in self.job_results:
+                self.signals.append(SimpleNamespace(body=(self._job_id, job_path, name, self.job_results[name])))
+            return new_method_return(msg, "o", (job_path,))
+        return new_method_return(msg)
+
+    @contextmanager
+    def filter(self, rule, bufsize=1):
+        yield self.signals
+
+    def recv_until_filtered(self, queue, timeout=None):
+        if len(queue) == 0:
+            raise TimeoutError("no JobRemoved signal")
+        return queue.popleft()
+
+
+@pytest.fixture
+def systemctl_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(_loytra_servicer, "run_bash_cmd", lambda cmd, *args, **kwargs: calls.append(cmd) or [])
+    monkeypatch.setattr(options, "systemd_backend", "auto")
+    yield calls
+    set_systemd_dbus_connection_factory(_systemd_dbus._open_jeepney_connection)
+
+
+def _use_connection(connection):
+    set_systemd_dbus_connection_factory(lambda is_user_unit: connection)
+
+
+def test_get_unit_states_maps_properties():
+    connection = FakeSystemdConnection(units={"a.service": {"ActiveState": "active", "SubState": "running", "Other": "x"},
+                                              "missing.service": {"LoadState": "not-found"}})
+    states = SystemdDBusManager(connection).get_unit_states(["a.service", "missing.service"], ["ActiveState", "SubState"])
+    assert states == {"a.service": {"ActiveState": "active", "SubState": "running"}, "missing.service": {}}
+
+
+def test_run_job_waits_for_its_own_job():
+    connection = FakeSystemdConnection(job_results={"a.service": "done", "b.service": "failed"})
+    manager = SystemdDBusManager(connection)
+    assert manager.start_unit("a.service") is True
+    assert manager.stop_unit("b.service") is False
+    # subscribed once for both jobs
+    assert [member for member, _ in connection.calls].count("Subscribe") == 1
+
+
+def test_queued_job_failure_does_not_retry_with_systemctl(systemctl_calls):
+    connection = FakeSystemdConnection()
+    _use_connection(connection)
+    assert systemd_dbus_call(True, lambda m: m.start_unit("a.service"), is_action=True) is False
+    Servicer("a.service", "/bin/true", "a").start()
+    assert ("StartUnit", ("a.service", "replace")) in connection.calls
+    assert not any("start" in cmd for cmd in systemctl_calls)
+
+
+def test_falls_back_when_connection_fails(systemctl_calls):
+    def factory(is_user_unit):
+        raise OSError("no session bus")
+    set_systemd_dbus_connection_factory(factory)
+    assert systemd_dbus_call(True, lambda m: m.start_unit("a.service"), is_action=True) is None
+    Servicer("a.service", "/bin/true", "a").start()
+    assert "systemctl --user start a.service" in systemctl_calls
+
+
+def test_dbus_backend_does_not_fall_back(systemctl_calls, monkeypatch):
+    def factory(is_user_unit):
+        raise OSError("no session bus")
+    set_systemd_dbus_connection_factory(factory)
+    monkeypatch.setattr(options, "systemd_backend", "dbus")
+    with pytest.raises(RuntimeError):
+        systemd_dbus_call(True, lambda m: m.start_unit("a.service"), is_action=True)
+    assert systemctl_calls == []